@@ -0,0 +1,90 @@
+"""
+Benchmark splitting a document from its token array against the TokenTextSplitter path it replaced.
+
+The current column reproduces the replaced split_by_tokens: the text is joined and filtered, counted with
+cl100k_base to size the chunks, then encoded again by a TokenTextSplitter with its default gpt2 encoding.
+The array columns tokenize the document once with cl100k_base and slice the chunks from the tokens.
+tiktoken downloads the cl100k_base and gpt2 encodings on first use. Run from the repository root:
+
+    python -m backend.benchmarks.bench_token_splitter --sizes 100000 400000 800000
+"""
+import time
+import random
+import argparse
+
+import tiktoken
+from langchain.schema import Document
+from langchain.text_splitter import TokenTextSplitter
+
+from backend.src.utility.summariztion_utils import get_encoding, tokenize_doc, split_by_tokens
+
+WORDS = ["market", "revenue", "growth", "the", "of", "and", "risk", "capital", "interest",
+         "rate", "inflation", "asset", "return", "portfolio", "analysis", "\n", "2024", "%"]
+
+
+def make_text(num_tokens, seed=42):
+    """
+    Build a synthetic document of roughly num_tokens tokens.
+    """
+    rng = random.Random(seed)
+    words = [rng.choice(WORDS) for _ in range(num_tokens)]
+    return ' '.join(words)
+
+
+def bench_current(doc, num_clusters, ratio=5, minimum_tokens=200, maximum_tokens=2000):
+    """
+    The replaced split_by_tokens and doc_to_text, kept verbatim so the comparison does not follow later changes.
+    """
+    start = time.perf_counter()
+    text = ''
+    for i in doc:
+        text += i.page_content
+    special_tokens = ['>|endoftext|', '<|fim_prefix|',
+                      '<|fim_middle|', '<|fim_suffix|', '<|endofprompt|']
+    words = text.split()
+    filtered_words = [word for word in words if word not in special_tokens]
+    text = ' '.join(filtered_words)
+    encoding = tiktoken.get_encoding('cl100k_base')
+    tokens = len(encoding.encode(text, disallowed_special=()))
+    chunks = num_clusters * ratio
+    max_tokens = int(tokens / chunks)
+    max_tokens = max(minimum_tokens, min(max_tokens, maximum_tokens))
+    overlap = int(max_tokens/10)
+    splitter = TokenTextSplitter(
+        chunk_size=max_tokens, chunk_overlap=overlap)
+    docs = splitter.create_documents([text])
+    return time.perf_counter() - start, len(docs)
+
+
+def bench_token_array(doc, num_clusters, decode_all):
+    start = time.perf_counter()
+    _, tokens = tokenize_doc(doc)
+    chunks = split_by_tokens(doc, num_clusters, tokens=tokens)
+    # decode_all matches the summarizer, which embeds every chunk; otherwise only num_clusters chunks are read.
+    indices = range(len(chunks)) if decode_all else range(
+        0, len(chunks), max(1, len(chunks) // num_clusters))
+    for i in indices:
+        chunks[i].page_content
+    return time.perf_counter() - start, len(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[100000, 200000, 400000, 800000])
+    parser.add_argument("--num-clusters", type=int, default=10)
+    args = parser.parse_args()
+
+    get_encoding()
+    tiktoken.get_encoding('gpt2')
+    print(f"{'tokens':>8} {'chunks':>7} {'current':>9} {'chunks':>7} {'array':>9} {'array lazy':>11}")
+    for size in args.sizes:
+        doc = [Document(page_content=make_text(size))]
+        current, current_chunks = bench_current(doc, args.num_clusters)
+        array, array_chunks = bench_token_array(doc, args.num_clusters, True)
+        lazy, _ = bench_token_array(doc, args.num_clusters, False)
+        print(f"{size:>8} {current_chunks:>7} {current:>8.3f}s {array_chunks:>7} {array:>8.3f}s {lazy:>10.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,34 +2,17 @@ import sys
 import json
 import os
 import re
-import string
-import random
 from dotenv import load_dotenv
-from openai import OpenAI
-from pinecone import Pinecone, ServerlessSpec
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pinecone import ServerlessSpec
+from backend.src.utility.vector_store import get_vector_client
+from backend.src.utility.resources import embed_texts, get_index
+from backend.src.utility.namespace_registry import record_sync
+from backend.src.utility.pinecone_utils import get_text_splitter, sync_chunks, sync_sources
 
 load_dotenv()
 
-# Initialize Pinecone and OpenAI clients
-pinecone_client = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-
-# Function to chunk and embed text data
-def chunk_and_embed(data):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,
-        chunk_overlap=20,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    chunks = splitter.split_text(data)
-    embeddings = openai_client.embeddings.create(
-        input=chunks,
-        model="text-embedding-3-small"
-    )
-    return chunks, embeddings
+# Initialize the Pinecone client
+pinecone_client = get_vector_client()
 
 
 # Function to create Pinecone index if not already existing
@@ -49,24 +32,14 @@ def create_index(index_name):
         print("Pinecone index created successfully.")
 
 
-# Function to upsert data into Pinecone
-def upsert_into_pinecone(index_name, namespace_name, data_chunks, embeddings):
-    embedding_to_upsert = []
-    # Iterate over chunks and their embeddings
-    for i, chunk in enumerate(data_chunks):
-        # Generate a unique ID for each chunk
-        rand_chunk_code = ''.join(random.choices(
-            string.ascii_letters + string.digits, k=3))
-        # Append the chunk embedding and metadata to upsert list
-        embedding_to_upsert.append({'id': f'doc-summ-{rand_chunk_code}',
-                                    'values': embeddings.data[i].embedding, 'metadata': {'text': chunk}})
+# Function to embed and upsert chunks, skipping unchanged ones and deleting removed ones
+def index_chunks(index_name, chunks, namespace, id_prefix=None):
     try:
-        # Get the index object
-        index = pinecone_client.Index(index_name)
-        # Upsert embeddings into the index
-        index.upsert(vectors=list(embedding_to_upsert),
-                     namespace=namespace_name)
-        print("Data upserted into Pinecone successfully.")
+        index = get_index(index_name)
+        stats = sync_chunks(index, namespace, chunks, embed_texts, prefix=id_prefix)
+        record_sync(index_name, namespace, stats)
+        print(f"Data indexed into Pinecone: {stats}")
+        return stats
     except Exception as e:
         print(f"Error occurred while upserting into Pinecone: {e}")
 
@@ -104,52 +77,65 @@ def generate_markdown_from_json(data):
 
 def split_and_upsert(index_name, raw_text, namespace):
     try:
-        # Chunk and embed the markdown text
-        qa_chunks, embeddings = chunk_and_embed(raw_text)
-        # Upsert embeddings into Pinecone
-        upsert_into_pinecone(index_name, namespace, qa_chunks, embeddings)
+        # Chunk the text, only new or changed chunks are embedded and upserted
+        index_chunks(index_name, get_text_splitter().split_text(raw_text), namespace)
     except Exception as e:
         print(f"Error processing QA data: {str(e)}")
 
 
-# Function to get questions from JSON files and upsert into Pinecone
-def get_question_and_upsert(topic, set='A'):
+# Function to split every QA item of a set into chunks
+def iter_qa_chunks(json_data):
+    splitter = get_text_splitter()
+    for qa_data in json_data:
+        try:
+            markdown_text = generate_markdown_from_json(qa_data)
+            yield from splitter.split_text(markdown_text)
+        except Exception as e:
+            print(f"Error processing QA data: {str(e)}")
+
+
+# Function to get questions of several topics from JSON files and upsert them into Pinecone together
+def get_questions_and_upsert(topics, set='A'):
     try:
-        # Generate the filename for the JSON data
-        filename = generate_filename(topic, 'json', '_', set)
-        file_path = f"json_files/{filename}"
-        if os.path.exists(file_path):
+        sources = []
+        for topic in topics:
+            # Generate the filename for the JSON data
+            filename = generate_filename(topic, 'json', '_', set)
+            file_path = f"json_files/{filename}"
+            if not os.path.exists(file_path):
+                print(f"File '{file_path}' does not exist.")
+                continue
             print(file_path)
             print("Processing QA data...")
             json_data = get_qa_from_file(file_path)
-            if len(json_data):
-                # Create Pinecone index if not already existing
-                create_index('study-bot')
-                for qa_data in json_data:
-                    try:
-                        markdown_text = generate_markdown_from_json(qa_data)
-                        # Chunk and embed the markdown text
-                        qa_chunks, embeddings = chunk_and_embed(markdown_text)
-                        # Get the filename without extension
-                        filename = filename.split(".")[0]
-                        # Upsert embeddings into Pinecone
-                        upsert_into_pinecone('study-bot',
-                                             f'{filename}', qa_chunks, embeddings)
-                    except Exception as e:
-                        print(f"Error processing QA data: {str(e)}")
-        else:
-            print(f"File '{file_path}' does not exist.")
+            if json_data:
+                # Get the filename without extension
+                namespace = filename.split(".")[0]
+                sources.append((namespace, None, list(iter_qa_chunks(json_data))))
+        if sources:
+            # Create Pinecone index if not already existing
+            create_index('study-bot')
+            # The QA items of every set share the embedding requests
+            index = get_index('study-bot')
+            results = sync_sources(index, sources, embed_texts)
+            for (namespace, _, _), stats in zip(sources, results):
+                record_sync('study-bot', namespace, stats)
+            print(f"Data indexed into Pinecone: {results}")
+            return results
     except Exception as e:
         print(f"Error: {str(e)}")
 
 
+# Function to get questions from JSON files and upsert into Pinecone
+def get_question_and_upsert(topic, set='A'):
+    return get_questions_and_upsert([topic], set)
+
+
 # # Main function to iterate over topics and process QA data
 # def main(set):
 #     topics = ['Machine Learning',
 #               'Organizing, Visualizing, and Describing Data']
-#     for topic in topics:
-#         get_question_and_upsert(topic, set)
-#         break
+#     get_questions_and_upsert(topics, set)
 
 
 # # Entry point of the script
@@ -1,33 +1,16 @@
 import os
-from openai import OpenAI
 from dotenv import load_dotenv
 
-from pinecone import Pinecone, ServerlessSpec
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import string
-import random
+from pinecone import ServerlessSpec
 from dotenv import load_dotenv
+from backend.src.utility.vector_store import get_vector_client
+from backend.src.utility.resources import embed_texts, get_index
+from backend.src.utility.namespace_registry import record_sync
+from backend.src.utility.pinecone_utils import get_text_splitter, sync_chunks, sync_sources
 
 load_dotenv()
 
-pinecone_client = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-
-# Function to chunk and embed data
-def chunk_and_embed(data):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,
-        chunk_overlap=20,
-        length_function=len,
-        separators=["\n\n", "\n", " ", ""]
-    )
-    chunks = splitter.split_text(data)
-    embeddings = openai_client.embeddings.create(
-        input=chunks,
-        model="text-embedding-3-small"
-    )
-    return chunks, embeddings
+pinecone_client = get_vector_client()
 
 
 def create_index(index_name='cfa-articles-summary'):
@@ -49,21 +32,16 @@ def create_index(index_name='cfa-articles-summary'):
             )
         )
 
-# Function to upsert data into Pinecone
 
-
-def upsert_into_pinecone(namespace, data_chunks, embeddings):
-    embedding_to_upsert = []
-    for i, chunk in enumerate(data_chunks):
-        rand_chunk_code = ''.join(random.choices(
-            string.ascii_letters + string.digits, k=3))
-        embedding_to_upsert.append({'id': f'doc-summ-{rand_chunk_code}',
-                                   'values': embeddings.data[i].embedding, 'metadata': {'text': chunk}})
+# Function to embed and upsert chunks, skipping unchanged ones and deleting removed ones
+def index_chunks(namespace, chunks):
     try:
         create_index()
-        index = pinecone_client.Index('cfa-articles-summary')
-        index.upsert(vectors=list(embedding_to_upsert),
-                     namespace=namespace)
+        index = get_index('cfa-articles-summary')
+        stats = sync_chunks(index, namespace, chunks, embed_texts)
+        record_sync('cfa-articles-summary', namespace, stats)
+        print(f"Data indexed into Pinecone: {stats}")
+        return stats
     except Exception as e:
         print(f"Error occurred while upserting into Pinecone: {e}")
 
@@ -78,29 +56,50 @@ def get_summary_from_md(file_path):
         return None
 
 
-# Function to generate GPT summary and upsert into Pinecone
-def get_summary_and_upsert(topic):
-    # Get GPT summary
-    file_path = f"md_files/{topic}_technical_summary.md"
-    if os.path.exists(file_path):
-        summary_content = get_summary_from_md(file_path)
+# Function to embed and upsert chunks of several namespaces, sharing the embedding requests between them
+def index_sources(sources):
+    try:
+        create_index()
+        index = get_index('cfa-articles-summary')
+        results = sync_sources(index, sources, embed_texts)
+        for (namespace, _, _), stats in zip(sources, results):
+            record_sync('cfa-articles-summary', namespace, stats)
+        print(f"Data indexed into Pinecone: {results}")
+        return results
+    except Exception as e:
+        print(f"Error occurred while upserting into Pinecone: {e}")
+
+
+def summary_namespace(topic):
+    return f'doc-summary-{topic.replace(" ", "-")}'
+
 
-        # Chunk and embed GPT summary
-        summary_chunks, embeddings = chunk_and_embed(summary_content)
+# Function to read GPT summaries of several topics and upsert them into Pinecone together
+def get_summaries_and_upsert(topics):
+    sources = []
+    for topic in topics:
+        file_path = f"md_files/{topic}_technical_summary.md"
+        if os.path.exists(file_path):
+            summary_content = get_summary_from_md(file_path)
+            # Chunk the GPT summary, only new or changed chunks are embedded and upserted
+            sources.append((summary_namespace(topic), None,
+                            get_text_splitter().split_text(summary_content)))
+        else:
+            print(f"File '{file_path}' does not exist.")
+    if sources:
+        index_sources(sources)
 
-        # Upsert embeddings into Pinecone
-        upsert_into_pinecone(
-            f'doc-summary-{topic.replace(" ", "-")}', summary_chunks, embeddings)
-    else:
-        print(f"File '{file_path}' does not exist.")
+
+# Function to generate GPT summary and upsert into Pinecone
+def get_summary_and_upsert(topic):
+    get_summaries_and_upsert([topic])
 
 
 def main():
     try:
         topics = ['Time-Series Analysis', 'Machine Learning',
                   'Organizing, Visualizing, and Describing Data']
-        for topic in topics:
-            get_summary_and_upsert(topic)
+        get_summaries_and_upsert(topics)
     except Exception as e:
         print(e)
 
@@ -1,21 +1,32 @@
 import json
 import os
+import asyncio
 import logging
 import pathlib
+from typing import Optional
 
-from fastapi import FastAPI, Path, HTTPException, UploadFile, File, Request
+from fastapi import FastAPI, Path, Query, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 
-import openai
-from pinecone import Pinecone
 
 from backend.src.utility.gpt_utilis import *
-from backend.src.utility.manage_db import saveUserToDb, saveUserFileDetailsToDb, get_user_file_details, get_user_file_summary
-from backend.src.utility.summazire import process_summarize_button
+from backend.src.utility.manage_db import saveUserToDb, saveUserFileDetailsToDb, \
+    close_mongodb_client, get_mongo_pool_metrics, ensure_indexes
+from backend.src.utility import async_manage_db as async_db
+from backend.src.utility.embedding_cache import get_embedding_cache_stats
+from backend.src.utility.vector_store import get_vector_client
+from backend.src.utility.resources import get_openai_client, get_index
+from backend.src.utility.namespace_registry import namespace_exists
+from backend.src.utility.summazire import process_summarize_button, get_summary_settings
+from backend.src.utility.pdf_extraction import extract_to_text_file, prune_extracted_text
+from backend.src.utility.summary_cache import hash_file, summary_cache_key, get_cached_summary, cache_summary
+from backend.src.utility.checkpoints import PipelineCheckpoint, prune_checkpoints
 from backend.gpt.src.upsert_qa_to_pinecode import split_and_upsert
 from backend.src.utility.file_utils import get_file_location, generate_filename_by_name
+from backend.src.utility.job_queue import submit_job, get_job, get_job_events, shutdown_job_queue, QueueFullError, \
+    PENDING, DONE, FAILED
 # Load environment variables
 load_dotenv()
 
@@ -29,9 +40,9 @@ app = FastAPI()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 # Initialize OpenAI and Pinecone clients
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
+client = get_openai_client()
 MODEL = "text-embedding-3-small"
-pinecone_client = Pinecone(api_key=PINECONE_API_KEY)
+pinecone_client = get_vector_client()
 print(pinecone_client)
 index_name = 'study-bot'
 
@@ -69,38 +80,58 @@ def get_sf_data():
 
 
 @app.get("/get_file_names_data/{user_id}")
-def get_file_names_data(user_id: str):
+async def get_file_names_data(user_id: str, limit: int = Query(100, ge=1, le=1000), after: Optional[str] = None):
     """
-    Retrieves file names data for a specific user ID.
+    Retrieves a page of file names for a specific user ID.
+    Pass the returned "next" value as "after" to get the following page.
     """
     try:
-        result = get_user_file_details(user_id)
-        data = []
+        result = await async_db.get_user_file_details(user_id, limit, after)
         if result:
             data = [doc["file_name"] for doc in result]
             print(data)
-            return JSONResponse(content={"data": data})
-        else:
-            raise HTTPException(
-                status_code=404, detail=f"File names data not found.")
+            next_after = data[-1] if len(data) == limit else None
+            return JSONResponse(content={"data": data, "next": next_after})
+        if after is not None:
+            # The previous page was exactly full, this one ends the listing
+            return JSONResponse(content={"data": [], "next": None})
+        raise HTTPException(
+            status_code=404, detail=f"File names data not found.")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching summary data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/get_file_summary_data/{user_id}/{selected_file}")
-def get_file_summary_data(user_id: str = Path(...), selected_file: str = Path(...)):
+async def get_file_summary_data(request: Request, user_id: str = Path(...), selected_file: str = Path(...)):
     """
     Retrieves summary data for a specific user ID and selected file.
+    Responds with 304 when the If-None-Match header matches the summary's ETag.
     """
     try:
-        result = get_user_file_summary(user_id, selected_file)
-        if result:
-            data = result["summary"]
-            return JSONResponse(content={"data": data})
-        else:
+        result = await async_db.get_user_file_summary(user_id, selected_file)
+        if not result:
             raise HTTPException(
                 status_code=404, detail=f"File names data not found.")
+        # Legacy records may hold neither a summary nor a summary_hash
+        content_hash = result.get("summary_hash")
+        if not content_hash:
+            raise HTTPException(
+                status_code=404, detail="Summary not found.")
+        etag = f'"{content_hash}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        data = result.get("summary")
+        if data is None:
+            data = await async_db.get_summary_blob(content_hash)
+        if data is None:
+            raise HTTPException(
+                status_code=404, detail="Summary not found.")
+        return JSONResponse(content={"data": data}, headers={"ETag": etag})
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching summary data: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -238,40 +269,187 @@ def get_answer_stats(based: str):
         raise HTTPException(status_code=500, detail=f"Type error: {e}")
 
 
+def process_uploaded_file(file_location, filename, progress=None):
+    """
+    Summarize an uploaded file, save the summary to the db and upsert the file content into Pinecone.
+    The PDF is extracted once into a text file shared by summarization and indexing.
+    Repeat uploads of the same bytes with the same settings are served from the summary cache,
+    and a run that failed or was interrupted resumes from its last checkpointed stage.
+    Runs on the background job pool, progress receives the stage events streamed by /jobs/{job_id}/events.
+    """
+    response = {'file_name': filename, 'summary': ""}
+    report = {}
+    use_gpt_4 = True
+    find_clusters = False
+    settings = get_summary_settings(use_gpt_4, find_clusters)
+    document_hash = hash_file(file_location)
+    cache_key = summary_cache_key(document_hash, settings)
+    cached = get_cached_summary(cache_key)
+    checkpoint = PipelineCheckpoint(cache_key)
+    # Another upload of the same document holds its checkpoints, this one runs without them
+    if not checkpoint.claim():
+        checkpoint = None
+    try:
+        text_path = None
+        if cached:
+            print("summary cache hit")
+            if progress:
+                progress("cached", {})
+            summary = cached["summary"]
+            namespaces = cached.get("namespaces", [])
+        else:
+            text_path = extract_to_text_file(file_location, document_hash)
+            if progress:
+                progress("extracted", {})
+            summary = process_summarize_button(file_location, OPENAI_API_KEY,
+                                               use_gpt_4, find_clusters, file=True, text_path=text_path, report=report,
+                                               progress=progress, checkpoint=checkpoint)
+            namespaces = []
+        if not summary:
+            raise Exception("Summary could not be generated for the file.")
+        response['summary'] = summary
+        # Share of the map chunks that made it through the map and reduce phases, cached summaries were complete
+        response['coverage'] = report.get("coverage", 1.0)
+        response['failed_chunks'] = report.get("failed_chunks", [])
+        try:
+            saveUserFileDetailsToDb(
+                "662c7428fb45c882e17567b8", response)
+            print("saved to db")
+            namespace = generate_filename_by_name(filename)
+            if namespace not in namespaces:
+                if not text_path:
+                    text_path = extract_to_text_file(file_location, document_hash)
+                stats = upsert(file_location, filename, text_path)
+                # Only a fully indexed namespace is cached, a failed upsert is retried by the next upload
+                if stats and not stats["failed_batches"]:
+                    namespaces.append(namespace)
+        except Exception as e:
+            print(str(e))
+        # A partial summary is not cached, the next upload of the file retries the failed chunks
+        if response['coverage'] == 1.0:
+            cache_summary(cache_key, {"summary": summary,
+                          "namespaces": namespaces})
+            if checkpoint:
+                checkpoint.clear()
+        return response
+    finally:
+        if checkpoint:
+            checkpoint.release()
+
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     """
-    Uploads a file and retrieves its summary.
+    Uploads a file and queues a job to generate its summary.
     """
     try:
-        response = {'file_name': "", 'summary': ""}
-        if file:
-            response['file_name'] = file.filename
-            file_location = get_file_location(file.filename)
-            with open(file_location, "wb+") as file_object:
-                file_object.write(file.file.read())
-            print(file_location)
-            use_gpt_4 = True
-            find_clusters = False
-            summary = process_summarize_button(file_location, OPENAI_API_KEY,
-                                               use_gpt_4, find_clusters, file=True)
-            if summary:
-                response['summary'] = summary
-                try:
-                    saveUserFileDetailsToDb(
-                        "662c7428fb45c882e17567b8", response)
-                    print("saved to db")
-                    upsert(file_location, file.filename)
-                except Exception as e:
-                    print(str(e))
-
-        return JSONResponse(status_code=200, content=response)
+        if not file:
+            raise HTTPException(status_code=400, detail="No file uploaded.")
+        file_location = get_file_location(file.filename)
+        content = await file.read()
+        with open(file_location, "wb+") as file_object:
+            file_object.write(content)
+        print(file_location)
+        job_id = submit_job(process_uploaded_file,
+                            file_location, file.filename, with_progress=True)
+        response = {'file_name': file.filename,
+                    'job_id': job_id, 'status': PENDING}
+        return JSONResponse(status_code=202, content=response)
+    except QueueFullError as e:
+        return JSONResponse(status_code=503, content={"detail": str(e)})
     except HTTPException as http_exc:
         return JSONResponse(status_code=http_exc.status_code, content={"detail": http_exc.detail})
     except Exception as e:
         return JSONResponse(status_code=500, content={"detail": f"An unexpected error occurred: {str(e)}"})
 
 
+@app.get("/jobs/{job_id}")
+def get_job_status(job_id: str = Path(...)):
+    """
+    Retrieves the status of an upload job.
+    """
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"job_id": job_id, "status": job["status"], "error": job["error"],
+            "created_at": job["created_at"], "started_at": job["started_at"],
+            "finished_at": job["finished_at"]}
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str = Path(...)):
+    """
+    Retrieves the result of a finished upload job.
+    """
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != DONE:
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": job["status"]})
+    return JSONResponse(status_code=200, content=job["result"])
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def job_event_stream(job_id, poll_interval=0.1):
+    last_event_id = 0
+    while True:
+        events, status = get_job_events(job_id, last_event_id)
+        if events is None:
+            return
+        for event in events:
+            yield format_sse(event["event"], event["data"])
+        if events:
+            last_event_id = events[-1]["id"]
+        # The status is read together with the events, so every event of a finished job was sent above
+        if status == DONE:
+            yield format_sse("done", get_job(job_id)["result"])
+            return
+        if status == FAILED:
+            yield format_sse("failed", {"detail": get_job(job_id)["error"]})
+            return
+        await asyncio.sleep(poll_interval)
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str = Path(...)):
+    """
+    Streams the progress of an upload job as Server-Sent Events: extracted, chunked, embedded, map, reduce, combine
+    and the summary tokens as they are generated, ending with a done event carrying the result or a failed event.
+    """
+    events, _ = get_job_events(job_id)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return StreamingResponse(job_event_stream(job_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.on_event("startup")
+def startup_event():
+    ensure_indexes()
+    prune_checkpoints()
+    prune_extracted_text()
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Returns the MongoDB connection pool and embedding cache counters.
+    """
+    return {"mongo_pool": get_mongo_pool_metrics(), "embedding_cache": get_embedding_cache_stats()}
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    shutdown_job_queue()
+    close_mongodb_client()
+    async_db.close_async_mongodb_client()
+
+
 # @app.post("/file/upload")
 # async def upload_file_and_get_summary(username: str, uploaded_file: UploadFile = File(...), use_gpt_4=True, find_clusters=False):
 #     """
@@ -303,15 +481,19 @@ async def upload_file(file: UploadFile = File(...)):
 #         print(str(e))
 
 
-def upsert(file_location, filename):
-    index = pinecone_client.Index(index_name)
-    namespace_list = index.describe_index_stats()["namespaces"].keys()
-    if len(namespace_list):
-        namespace = generate_filename_by_name(filename)
-        print("namespace in namespace_list")
-        print(namespace in namespace_list)
-        if namespace not in namespace_list:
-            upsert_file_content(index_name, file_location, namespace)
+def upsert(file_location, filename, text_path=None):
+    """
+    Index a file into its namespace unless the namespace already exists.
+
+    :return: The index_chunks stats, "existing" is set when nothing had to be indexed, None if indexing failed.
+    """
+    index = get_index(index_name)
+    namespace = generate_filename_by_name(filename)
+    # Served from the namespace registry, upsert_file_content registers the namespace once written
+    if namespace_exists(index, index_name, namespace):
+        return {"upserted": 0, "skipped": 0, "deleted": 0, "failed_batches": 0, "existing": True}
+    return upsert_file_content(index_name, file_location,
+                               namespace, text_path=text_path)
 
 
 @app.post("/get_answer_by_chain")
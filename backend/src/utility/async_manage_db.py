@@ -0,0 +1,111 @@
+"""
+Asyncio versions of the manage_db helpers for the FastAPI endpoints, backed by Motor.
+Scripts and the background job pool keep using the synchronous manage_db module.
+"""
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+
+from backend.src.utility.manage_db import DATABASE_NAME, get_connection_string, get_client_options, \
+    file_name_query, numbered_file_name, file_names_page_query, FILE_NAMES_PROJECTION, FILE_NAMES_SORT, \
+    FILE_SUMMARY_PROJECTION, summary_hash, summary_blob_doc, decompress_summary_blob
+
+_client = None
+
+
+def get_async_mongo_client():
+    """
+    Get the process wide Motor client, creating it on first use from inside the event loop.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncIOMotorClient(
+            get_connection_string(), **get_client_options())
+        print("Async connection established to MongoDB")
+    return _client
+
+
+def close_async_mongodb_client():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+
+def connect_to_mongodb_collection(collection_name):
+    try:
+        return get_async_mongo_client()[DATABASE_NAME][collection_name]
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+
+
+async def saveDocumentToDb(collection_name, doc):
+    try:
+        collection = connect_to_mongodb_collection(collection_name)
+        await collection.insert_one(doc)
+    except Exception as e:
+        print("Error in Storing user to DB", e)
+        return None
+
+
+async def save_summary_blob(summary):
+    blob = summary_blob_doc(summary)
+    collection = connect_to_mongodb_collection("SummaryBlobs")
+    await collection.update_one({"_id": blob["_id"]}, {
+                                "$setOnInsert": blob}, upsert=True)
+    return blob["_id"]
+
+
+async def get_summary_blob(summary_hash):
+    try:
+        collection = connect_to_mongodb_collection("SummaryBlobs")
+        return decompress_summary_blob(await collection.find_one({"_id": summary_hash}))
+    except Exception as e:
+        print("Error in reading summary from DB", e)
+        return None
+
+
+async def saveUserFileDetailsToDb(user_id, data, max_attempts=5):
+    try:
+        doc = {"user_id": user_id, 'file_name': data["file_name"],
+               'summary_hash': await save_summary_blob(data["summary"])}
+        file_name = doc["file_name"]
+
+        collection = connect_to_mongodb_collection("UserFileDetails")
+        for attempt in range(max_attempts):
+            count = await collection.count_documents(file_name_query(user_id, file_name))
+            doc['file_name'] = numbered_file_name(file_name, count + attempt)
+            try:
+                await collection.insert_one(doc)
+                return doc['file_name']
+            except DuplicateKeyError:
+                doc.pop("_id", None)
+        print("Could not allocate a file name for", file_name)
+        return None
+    except Exception as e:
+        print("Error in Storing user to DB", e)
+        return None
+
+
+async def get_user_file_details(user_id, limit=100, after=None):
+    try:
+        collection = connect_to_mongodb_collection("UserFileDetails")
+        cursor = collection.find(file_names_page_query(user_id, after), FILE_NAMES_PROJECTION).sort(
+            FILE_NAMES_SORT).limit(limit)
+        return await cursor.to_list(length=limit)
+    except Exception as e:
+        print("Error in Storing user to DB", e)
+        return None
+
+
+async def get_user_file_summary(user_id, file_name):
+    try:
+        collection = connect_to_mongodb_collection("UserFileDetails")
+        result = await collection.find_one(
+            {"user_id": user_id, "file_name": file_name}, FILE_SUMMARY_PROJECTION)
+        if result and "summary_hash" not in result and result.get("summary") is not None:
+            result["summary_hash"] = summary_hash(result["summary"])
+        return result
+    except Exception as e:
+        print("Error in Storing user to DB", e)
+        return None
@@ -0,0 +1,161 @@
+"""
+Stage checkpoints of the summarization pipeline, keyed by the summary cache key (document hash and settings).
+
+Extraction and embeddings already persist on their own (the extracted text file and the embedding cache).
+The remaining stages are written under CHECKPOINT_DIR/<key>/ as they complete: the token array, the selected
+clusters, every map summary as soon as it is generated, the reduced summaries and the final summary.
+A rerun after a crash or a failed call resumes from the last completed stage.
+Concurrent uploads of the same document map to the same directory, so a job has to claim the key first and
+the uploads that find it taken run without checkpoints.
+"""
+import os
+import json
+import time
+import shutil
+import pathlib
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHECKPOINT_DIR = os.getenv(
+    "CHECKPOINT_DIR", str(pathlib.Path.home() / "summary_checkpoints"))
+# Checkpoints of runs that never completed are removed after this many seconds.
+CHECKPOINT_MAX_AGE = int(os.getenv("CHECKPOINT_MAX_AGE", 7 * 24 * 3600))
+
+# The keys claimed by running jobs of this process.
+_claimed_keys = set()
+_claimed_keys_lock = threading.Lock()
+
+
+class PipelineCheckpoint:
+    """
+    The checkpoints of one document summarized with one set of settings.
+    """
+
+    def __init__(self, key, root=CHECKPOINT_DIR):
+        self.key = key
+        self.directory = pathlib.Path(root) / key
+        self._lock = threading.Lock()
+        self._claimed = False
+
+    def claim(self):
+        """
+        Claim the key for the calling job, only its holder may read or write the checkpoints.
+
+        :return: True if the key was claimed, False if another job holds it.
+        """
+        with _claimed_keys_lock:
+            if self.key in _claimed_keys:
+                return False
+            _claimed_keys.add(self.key)
+        self._claimed = True
+        return True
+
+    def release(self):
+        if self._claimed:
+            self._claimed = False
+            with _claimed_keys_lock:
+                _claimed_keys.discard(self.key)
+
+    def _path(self, name):
+        return self.directory / name
+
+    def _write(self, name, write, mode="w"):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(name)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def load(self, stage):
+        """
+        Load the result of a completed stage.
+
+        :return: The json data saved for the stage, or None if the stage has not completed.
+        """
+        try:
+            with open(self._path(f"{stage}.json"), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, stage, data):
+        self._write(f"{stage}.json", lambda f: json.dump(data, f))
+
+    def load_array(self, stage):
+        """
+        Load a NumPy array saved for a stage, memory-mapped.
+
+        :return: The array, or None if the stage has not completed.
+        """
+        try:
+            return np.load(self._path(f"{stage}.npy"), mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_array(self, stage, array):
+        self._write(f"{stage}.npy", lambda f: np.save(
+            f, np.asarray(array)), mode="wb")
+
+    def load_map(self):
+        """
+        Load the map summaries generated so far.
+
+        :return: A dict of chunk position -> summary.
+        """
+        summaries = {}
+        try:
+            with open(self._path("map.jsonl"), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave a partial last line.
+                        continue
+                    summaries[record["position"]] = record["summary"]
+        except FileNotFoundError:
+            pass
+        return summaries
+
+    def save_map(self, position, summary):
+        """
+        Append one map summary, it survives a crash of the rest of the map phase.
+        """
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(self._path("map.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(
+                    {"position": position, "summary": summary}) + "\n")
+
+    def reset_map(self):
+        with self._lock:
+            try:
+                self._path("map.jsonl").unlink()
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """
+        Remove every checkpoint once the summary is safely cached.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def prune_checkpoints(max_age=CHECKPOINT_MAX_AGE):
+    """
+    Remove the checkpoints of runs that were abandoned more than max_age seconds ago.
+    """
+    root = pathlib.Path(CHECKPOINT_DIR)
+    if not root.exists():
+        return
+    now = time.time()
+    for directory in root.iterdir():
+        try:
+            if directory.is_dir() and now - directory.stat().st_mtime > max_age:
+                shutil.rmtree(directory, ignore_errors=True)
+        except FileNotFoundError:
+            pass
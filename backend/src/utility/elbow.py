@@ -1,8 +1,45 @@
+import os
+
 import numpy as np
-from sklearn.cluster import KMeans
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans, MiniBatchKMeans
 
 import matplotlib.pyplot as plt
 
+ELBOW_SAMPLE_SIZE = int(os.getenv("ELBOW_SAMPLE_SIZE", 2000))
+ELBOW_N_JOBS = int(os.getenv("ELBOW_N_JOBS", -1))
+
+
+def _fit_candidate(vectors, num_clusters):
+    kmeans = MiniBatchKMeans(n_clusters=num_clusters, random_state=42, n_init=3,
+                             batch_size=min(1024, len(vectors)))
+    return kmeans.fit(vectors)
+
+
+def fit_candidates(vectors, max_clusters=12, sample_size=ELBOW_SAMPLE_SIZE, n_jobs=ELBOW_N_JOBS):
+    """
+    Fit MiniBatchKMeans models for a range of clusters on a sample of the vectors, in parallel.
+
+    :param vectors: A list of vectors to cluster.
+
+    :param max_clusters: The maximum number of clusters to use.
+
+    :param sample_size: The maximum number of vectors to fit the candidates on.
+
+    :param n_jobs: The number of candidates to fit in parallel, -1 uses all cores.
+
+    :return: A tuple of the sampled float32 vectors and the list of fitted models for 1..max_clusters clusters.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if len(vectors) > sample_size:
+        rng = np.random.default_rng(42)
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    max_clusters = min(max_clusters, len(vectors))
+    # BLAS releases the GIL, so threads parallelize the fits without copying the vectors to worker processes.
+    models = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(_fit_candidate)(vectors, num_clusters) for num_clusters in range(1, max_clusters + 1))
+    return vectors, models
+
 
 def calculate_inertia(vectors, max_clusters=12):
     """
@@ -14,11 +51,33 @@ def calculate_inertia(vectors, max_clusters=12):
 
     :return: A list of inertia values.
     """
-    inertia_values = []
-    for num_clusters in range(1, max_clusters + 1):
-        kmeans = KMeans(n_clusters=num_clusters, random_state=42).fit(vectors)
-        inertia_values.append(kmeans.inertia_)
-    return inertia_values
+    _, models = fit_candidates(vectors, max_clusters)
+    return [kmeans.inertia_ for kmeans in models]
+
+
+def select_kmeans(vectors, max_clusters=12):
+    """
+    Pick the optimal number of clusters with the elbow method and return the winning model without refitting from scratch.
+    If the candidates were fitted on a sample, the winner's centers warm start a single full KMeans pass.
+
+    :param vectors: A list of vectors to cluster.
+
+    :param max_clusters: The maximum number of clusters to use.
+
+    :return: A fitted K-Means clustering object.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    sample, models = fit_candidates(vectors, max_clusters)
+    inertia_values = [kmeans.inertia_ for kmeans in models]
+    if len(inertia_values) < 2:
+        return models[-1]
+    num_clusters = determine_optimal_clusters(inertia_values)
+    print(f'Optimal number of clusters: {num_clusters}')
+    kmeans = models[num_clusters - 1]
+    if len(sample) < len(vectors):
+        kmeans = KMeans(n_clusters=num_clusters, init=kmeans.cluster_centers_,
+                        n_init=1, random_state=42).fit(vectors)
+    return kmeans
 
 
 def plot_elbow(inertia_values):
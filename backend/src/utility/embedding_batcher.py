@@ -0,0 +1,88 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# OpenAI accepts at most 2048 inputs and 300k tokens per embeddings request.
+EMBED_BATCH_MAX_ITEMS = int(os.getenv("EMBED_BATCH_MAX_ITEMS", 2048))
+EMBED_BATCH_MAX_TOKENS = int(os.getenv("EMBED_BATCH_MAX_TOKENS", 250000))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", 4))
+
+
+def plan_batches(texts, max_items=EMBED_BATCH_MAX_ITEMS, max_tokens=EMBED_BATCH_MAX_TOKENS):
+    """
+    Group texts into request sized batches.
+    The UTF-8 byte length is used as the token estimate: a token always covers at least one byte, so it never underestimates.
+
+    :param texts: A list of strings to embed.
+
+    :param max_items: The maximum number of texts per request.
+
+    :param max_tokens: The maximum number of tokens per request.
+
+    :return: A list of (start, end) ranges into texts.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        text_tokens = len(text.encode("utf-8"))
+        if i > start and (i - start >= max_items or tokens + text_tokens > max_tokens):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += text_tokens
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def embed_batched(texts, embed_fn, max_items=EMBED_BATCH_MAX_ITEMS, max_tokens=EMBED_BATCH_MAX_TOKENS,
+                  max_workers=EMBED_MAX_WORKERS):
+    """
+    Embed a list of texts with as few requests as the item and token budgets allow, sending the requests concurrently.
+
+    :param texts: A list of strings to embed.
+
+    :param embed_fn: A function embedding a list of strings into a list of vectors with one request.
+
+    :param max_items: The maximum number of texts per request.
+
+    :param max_tokens: The maximum number of tokens per request.
+
+    :param max_workers: The number of concurrent requests.
+
+    :return: A list of vectors in the same order as texts.
+    """
+    batches = plan_batches(texts, max_items, max_tokens)
+    if len(batches) <= 1:
+        return list(embed_fn(list(texts))) if texts else []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda batch: embed_fn(list(texts[batch[0]:batch[1]])), batches)
+        vectors = []
+        for batch_vectors in results:
+            vectors.extend(batch_vectors)
+    return vectors
+
+
+def embed_sources(sources, embed_fn):
+    """
+    Embed the texts of several sources (documents, QA items, ...) together and map the vectors back to each source.
+
+    :param sources: A dict of source key -> list of strings.
+
+    :param embed_fn: A function embedding a list of strings into a list of vectors, e.g. a cached embed_batched call.
+
+    :return: A dict of source key -> list of vectors.
+    """
+    texts = [text for source_texts in sources.values()
+             for text in source_texts]
+    vectors = embed_fn(texts) if texts else []
+    result = {}
+    offset = 0
+    for key, source_texts in sources.items():
+        result[key] = vectors[offset:offset + len(source_texts)]
+        offset += len(source_texts)
+    return result
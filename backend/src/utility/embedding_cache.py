@@ -0,0 +1,112 @@
+import os
+import pathlib
+import sqlite3
+import hashlib
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", str(pathlib.Path.home() / "embedding_cache.sqlite3"))
+
+_lock = threading.Lock()
+_connection = None
+_stats = {"hits": 0, "misses": 0}
+
+
+def _get_connection():
+    """
+    Lazily open the shared sqlite connection. Must be called with the lock held.
+    """
+    global _connection
+    if _connection is None:
+        pathlib.Path(EMBEDDING_CACHE_PATH).parent.mkdir(
+            parents=True, exist_ok=True)
+        _connection = sqlite3.connect(
+            EMBEDDING_CACHE_PATH, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))")
+        _connection.commit()
+    return _connection
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _lookup(model, hashes):
+    found = {}
+    with _lock:
+        connection = _get_connection()
+        # Stay well below sqlite's bound parameter limit.
+        for start in range(0, len(hashes), 500):
+            batch = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = connection.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *batch])
+            for row_hash, blob in rows:
+                found[row_hash] = np.frombuffer(blob, dtype=np.float32)
+    return found
+
+
+def _store(model, hashed_vectors):
+    with _lock:
+        connection = _get_connection()
+        connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in hashed_vectors])
+        connection.commit()
+
+
+def get_embeddings(texts, model, embed_fn):
+    """
+    Embed a list of texts, consulting the local cache first and only sending the misses to embed_fn.
+    Texts already embedded by any caller, e.g. unchanged chunks of a re-run upsert script, cost no API call.
+    Duplicate texts within the list are embedded once.
+
+    :param texts: A list of strings to embed.
+
+    :param model: The name of the embedding model, part of the cache key.
+
+    :param embed_fn: A function embedding a list of strings into a list of vectors.
+
+    :return: A list of vectors in the same order as texts.
+    """
+    hashes = [text_hash(text) for text in texts]
+    found = _lookup(model, list(set(hashes)))
+
+    missing = {}
+    for h, text in zip(hashes, texts):
+        if h not in found and h not in missing:
+            missing[h] = text
+    with _lock:
+        _stats["hits"] += len(texts) - sum(1 for h in hashes if h in missing)
+        _stats["misses"] += len(missing)
+
+    if missing:
+        missing_hashes = list(missing.keys())
+        vectors = embed_fn([missing[h] for h in missing_hashes])
+        _store(model, zip(missing_hashes, vectors))
+        for h, vector in zip(missing_hashes, vectors):
+            found[h] = np.asarray(vector, dtype=np.float32)
+
+    return [found[h].tolist() for h in hashes]
+
+
+def get_embedding_cache_stats():
+    """
+    Get the hit/miss counters of the embedding cache for this process.
+
+    :return: A dict with hits, misses and hit_rate.
+    """
+    with _lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    total = hits + misses
+    return {"hits": hits, "misses": misses, "hit_rate": hits / total if total else 0.0}
@@ -1,21 +1,21 @@
 import re
 import os
 import logging
-import openai
 import pathlib
-from pinecone import Pinecone
 from backend.src.utility.pydantic_models import *
-from PyPDF2 import PdfReader
 from requests.exceptions import ConnectionError, Timeout
 from retrying import retry
 from backend.src.utility.file_utils import generate_filename_by_name
-from backend.gpt.src.upsert_qa_to_pinecode import split_and_upsert, create_index
+from backend.src.utility.vector_store import get_vector_client
+from backend.src.utility.resources import get_openai_client, get_index, get_qa_chain, embed_texts
+from backend.src.utility.namespace_registry import ensure_index, namespace_exists
+from backend.src.utility.pinecone_utils import get_text_splitter
+from backend.gpt.src.upsert_qa_to_pinecode import split_and_upsert, create_index, index_chunks
+from backend.src.utility.pdf_extraction import iter_pdf_pages, extract_pdf_text, iter_split_pages, iter_extracted_pages
+from backend.src.utility.text_cleaning import iter_scrubbed_pages
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.text_splitter import CharacterTextSplitter
-from langchain.vectorstores import FAISS
 from typing_extensions import Concatenate
-from langchain.chains.question_answering import load_qa_chain
-from langchain.llms import OpenAI
 from langchain.schema import Document
 
 from dotenv import load_dotenv
@@ -37,9 +37,9 @@ retry_config = {
     'retry_on_exception': lambda exc: isinstance(exc, (ConnectionError, Timeout))
 }
 
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-MODEL = "text-embedding-3-small"
-pinecone_client = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+client = get_openai_client()
+# Pinecone, or the local index when VECTOR_STORE_BACKEND=local
+pinecone_client = get_vector_client()
 
 
 def gen_markdown_from_question(question: Question) -> str:
@@ -160,12 +160,14 @@ def generate_qa_filename(topic, filetype, set='A'):
     return filename
 
 
+def embed_query(query):
+    return embed_texts([query])[0]
+
+
 def retrieve(query, namespace_name='doc-summary-Time-Series-Analysis', index_name='cfa-articles-summary'):
     limit = 3750
-    index = pinecone_client.Index(index_name)
-    res = client.embeddings.create(input=query, model=MODEL)
-
-    xq = res.data[0].embedding
+    index = get_index(index_name)
+    xq = embed_query(query)
 
     match_res = index.query(
         vector=[xq], top_k=5, namespace=namespace_name, include_metadata=True)
@@ -199,10 +201,8 @@ def retrieve(query, namespace_name='doc-summary-Time-Series-Analysis', index_nam
 
 def retrieve_conext(query, index_name, namespace_name=''):
     #     limit = 3750
-    index = pinecone_client.Index(index_name)
-    res = client.embeddings.create(input=query, model=MODEL)
-
-    xq = res.data[0].embedding
+    index = get_index(index_name)
+    xq = embed_query(query)
 
     match_res = index.query(
         vector=[xq], top_k=5, namespace=namespace_name, include_metadata=True)
@@ -216,25 +216,35 @@ def retrieve_conext(query, index_name, namespace_name=''):
 def get_content_from_file(file_location):
     if file_location:
         # provide the path of  pdf file/files.
-        pdfreader = PdfReader(str(file_location))
-        # read text from pdf
-        raw_text = ''
-        for i, page in enumerate(pdfreader.pages):
-            content = page.extract_text()
-            if content:
-                raw_text += content
-        return raw_text
+        return extract_pdf_text(str(file_location))
     else:
         return None
 
 
-def upsert_file_content(index_name, file_location, namespace):
+def upsert_file_content(index_name, file_location, namespace, text_path=None):
+    """
+    Index the chunks of a file into a namespace.
+
+    :return: The stats returned by index_chunks, or None if indexing failed.
+    """
     try:
-        content = get_content_from_file(file_location)
-        if content:
-            split_and_upsert(index_name, content, namespace)
+        # Pages are read and split as a stream, only a batch of chunks is embedded at a time.
+        # An already extracted text file is used when available so the PDF is not parsed again.
+        if text_path:
+            pages = iter_extracted_pages(text_path)
+        else:
+            pages = iter_pdf_pages(str(file_location))
+        scrub_counter = {"removed": 0}
+        pages = iter_scrubbed_pages(pages, scrub_counter)
+        chunks = iter_split_pages(pages, get_text_splitter())
+        # Unchanged chunks are skipped and chunks no longer in the file are deleted
+        stats = index_chunks(index_name, chunks, namespace)
+        if scrub_counter["removed"]:
+            print(f'Removed {scrub_counter["removed"]} special tokens')
+        return stats
     except Exception as e:
         print(str(e))
+        return None
 
 
 def get_chain_run_result(query, index_name, filename):
@@ -242,32 +252,16 @@ def get_chain_run_result(query, index_name, filename):
         docs = []
         namespace_name = generate_filename_by_name(filename)
 
-        print(pinecone_client.list_indexes().names())
-        print(index_name in pinecone_client.list_indexes().names())
-        if index_name not in pinecone_client.list_indexes().names():
-            index = pinecone_client.Index(index_name)
-        else:
-            create_index(index_name)
-            index = pinecone_client.Index(index_name)
-        print(index)
-        namespace_list = list(index.describe_index_stats()[
-                              "namespaces"].keys())
-        print(namespace_list)
-        print(namespace_name)
-        print(namespace_name in namespace_list)
-        if len(namespace_list):
-            if namespace_name in namespace_list:
-                context = retrieve_conext(query, index_name, namespace_name)
-                for text in context:
-                    doc = Document(page_content=text)
-                    docs.append(doc)
-                chain = load_qa_chain(OpenAI(), chain_type="stuff")
-                response_msg = chain.run(input_documents=docs, question=query)
-                response = {"code": 200, "answer": response_msg}
-
-            else:
-                response = {
-                    "code": 404, "answer": "Knowledge base not found. Please try training again!"}
+        # Index and namespace existence come from the in-process registry, not a control plane call per question
+        ensure_index(index_name, create_index)
+        index = get_index(index_name)
+        if namespace_exists(index, index_name, namespace_name):
+            context = retrieve_conext(query, index_name, namespace_name)
+            for text in context:
+                doc = Document(page_content=text)
+                docs.append(doc)
+            response_msg = get_qa_chain().run(input_documents=docs, question=query)
+            response = {"code": 200, "answer": response_msg}
         else:
             response = {
                 "code": 404, "answer": "Knowledge base not found. Please try training again!"}
@@ -0,0 +1,168 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", 20))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 3600))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_executor = ThreadPoolExecutor(
+    max_workers=JOB_WORKERS, thread_name_prefix="upload-job")
+_jobs = {}
+_lock = threading.Lock()
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _prune_finished_jobs():
+    """
+    Drop finished jobs whose results are older than JOB_RESULT_TTL. Must be called with the lock held.
+    """
+    now = time.time()
+    expired = [job_id for job_id, job in _jobs.items()
+               if job["finished_at"] and now - job["finished_at"] > JOB_RESULT_TTL]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def _active_job_count():
+    return sum(1 for job in _jobs.values() if job["status"] in (PENDING, RUNNING))
+
+
+def _update_job(job_id, **fields):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job:
+            job.update(fields)
+
+
+def _finish_job(job_id, **fields):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job:
+            job.update(fields, finished_at=time.time())
+            # The final result carries the whole summary, only the stage events are worth keeping
+            job["events"] = [event for event in job["events"]
+                             if event["event"] != "token"]
+
+
+def _run_job(job_id, fn, args, kwargs):
+    _update_job(job_id, status=RUNNING, started_at=time.time())
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {str(e)}")
+        _finish_job(job_id, status=FAILED, error=str(e))
+    else:
+        _finish_job(job_id, status=DONE, result=result)
+
+
+def submit_job(fn, *args, with_progress=False, **kwargs):
+    """
+    Queue a function to run on the background worker pool.
+
+    :param fn: The function to run.
+
+    :param with_progress: Whether to pass fn a progress(event, data) callback publishing to the job's event log.
+
+    :return: The ID of the queued job.
+    """
+    with _lock:
+        _prune_finished_jobs()
+        if _active_job_count() >= MAX_PENDING_JOBS:
+            raise QueueFullError(
+                "Too many jobs in progress. Please try again later.")
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = {"job_id": job_id, "status": PENDING, "result": None, "error": None,
+                         "created_at": time.time(), "started_at": None, "finished_at": None,
+                         "events": [], "last_event_id": 0, "delivered_event_id": 0}
+    if with_progress:
+        kwargs["progress"] = partial(publish_event, job_id)
+    _executor.submit(_run_job, job_id, fn, args, kwargs)
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Get a copy of the job record for a job ID.
+
+    :param job_id: The ID returned by submit_job.
+
+    :return: The job record, or None if the job is unknown or expired.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def publish_event(job_id, event, data=None):
+    """
+    Append an event to the event log of a job.
+    Tokens published between two reads of the log are merged into one token event.
+
+    :param job_id: The ID returned by submit_job.
+
+    :param event: The event name.
+
+    :param data: A json serializable dict sent with the event, {"text": ...} for token events.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if not job:
+            return
+        events = job["events"]
+        last = events[-1] if events else None
+        # An event already read cannot grow, its reader would miss the new text
+        if event == "token" and last and last["event"] == "token" and last["id"] > job["delivered_event_id"]:
+            last["data"] = {"text": last["data"]["text"] + data["text"]}
+            return
+        job["last_event_id"] += 1
+        events.append({"id": job["last_event_id"],
+                      "event": event, "data": data or {}})
+
+
+def get_job_events(job_id, after=0):
+    """
+    Get the events of a job published after an event ID.
+
+    :param job_id: The ID returned by submit_job.
+
+    :param after: The ID of the last event already read, 0 to read the whole log.
+
+    :return: A tuple of the new events and the job status, or (None, None) if the job is unknown or expired.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if not job:
+            return None, None
+        events = job["events"]
+        # New events are at the end of the log, only they are scanned
+        start = len(events)
+        while start and events[start - 1]["id"] > after:
+            start -= 1
+        new_events = events[start:]
+        if new_events:
+            job["delivered_event_id"] = max(
+                job["delivered_event_id"], new_events[-1]["id"])
+        return new_events, job["status"]
+
+
+def shutdown_job_queue(wait=False):
+    _executor.shutdown(wait=wait)
@@ -1,6 +1,11 @@
+import re
 import time
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+import zlib
+import hashlib
+import threading
+from bson.binary import Binary
+from pymongo import MongoClient, ASCENDING, monitoring
+from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError, DuplicateKeyError, OperationFailure
 from dotenv import load_dotenv
 import os
 
@@ -9,15 +14,130 @@ USERNAME = os.getenv("USERNAME")
 PASSWORD = os.getenv("PASSWORD")
 CLUSTER_URL = os.getenv("CLUSTER_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 2))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(
+    os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))
+FILE_NAMES_PROJECTION = {"file_name": 1, "_id": 0}
+FILE_NAMES_SORT = [("user_id", ASCENDING), ("file_name", ASCENDING)]
+# Legacy records still carry the summary inline instead of a summary_hash.
+FILE_SUMMARY_PROJECTION = {"summary_hash": 1, "summary": 1, "_id": 0}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """
+    Counts connection pool checkouts and the time spent waiting for a connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.metrics = {"checkouts": 0, "checkout_failures": 0, "total_wait_ms": 0.0,
+                        "max_wait_ms": 0.0, "connections_created": 0, "connections_closed": 0}
+
+    def _increment(self, key, value=1):
+        with self._lock:
+            self.metrics[key] += value
+
+    def _wait_ms(self):
+        started = getattr(self._local, "checkout_started", None)
+        return (time.perf_counter() - started) * 1000 if started else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait_ms = self._wait_ms()
+        with self._lock:
+            self.metrics["checkouts"] += 1
+            self.metrics["total_wait_ms"] += wait_ms
+            self.metrics["max_wait_ms"] = max(
+                self.metrics["max_wait_ms"], wait_ms)
+
+    def connection_check_out_failed(self, event):
+        self._increment("checkout_failures")
+
+    def connection_created(self, event):
+        self._increment("connections_created")
+
+    def connection_closed(self, event):
+        self._increment("connections_closed")
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+pool_metrics = PoolMetricsListener()
+
+
+def get_connection_string():
+    return f"mongodb+srv://{USERNAME}:{PASSWORD}@{CLUSTER_URL}/{DATABASE_NAME}?retryWrites=true&w=majority&appName=clusterSD"
+
+
+def get_client_options():
+    """
+    Connection pool settings shared by the sync and async clients.
+    """
+    return {"maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            "event_listeners": [pool_metrics]}
+
+
+def get_mongo_client():
+    """
+    Get the process wide MongoClient, creating it on first use. The client owns a connection pool shared by all db helpers.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MongoClient(
+                    get_connection_string(), **get_client_options())
+                print("Connection established to MongoDB")
+    return _client
+
+
+def close_mongodb_client():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_mongo_pool_metrics():
+    """
+    Get the connection pool checkout counters and wait times for this process.
+    """
+    with pool_metrics._lock:
+        metrics = dict(pool_metrics.metrics)
+    checkouts = metrics["checkouts"]
+    metrics["avg_wait_ms"] = metrics["total_wait_ms"] / \
+        checkouts if checkouts else 0.0
+    return metrics
 
 
 def connect_to_mongodb():
-    connection_string = f"mongodb+srv://{USERNAME}:{PASSWORD}@{CLUSTER_URL}/{DATABASE_NAME}?retryWrites=true&w=majority&appName=clusterSD"
     try:
-        client = MongoClient(connection_string)
-        # client.admin.command('ping')
-        print("Connection established to MongoDB")
-        db = client[DATABASE_NAME]
+        db = get_mongo_client()[DATABASE_NAME]
         return db
     except ServerSelectionTimeoutError:
         print("Server selection timeout. Could not connect to MongoDB.")
@@ -32,7 +152,7 @@ def connect_to_mongodb():
 
 def connect_to_mongodb_collection(collection_name):
     db = connect_to_mongodb()
-    if db:
+    if db is not None:
         collection = db[collection_name]
         return collection
     else:
@@ -62,39 +182,143 @@ def saveDocumentToDb(collection_name, doc):
         return None
 
 
-def saveUserFileDetailsToDb(user_id, data):
+def ensure_indexes():
+    """
+    Create the indexes used by the file details queries. Safe to call on every startup.
+    """
     try:
+        collection = connect_to_mongodb_collection("UserFileDetails")
+        try:
+            collection.create_index([("user_id", ASCENDING), ("file_name", ASCENDING)],
+                                    unique=True, name="user_id_file_name")
+        except OperationFailure as e:
+            # Existing duplicate names prevent a unique index, fall back to a plain one.
+            print("Could not create unique file name index", e)
+            collection.create_index([("user_id", ASCENDING), ("file_name", ASCENDING)],
+                                    name="user_id_file_name_non_unique")
+    except Exception as e:
+        print("Error in creating indexes", e)
+
+
+def file_name_query(user_id, file_name):
+    """
+    Query matching a user's file_name and its numbered copies file_name-1, file_name-2, ...
+    """
+    pattern = f"^{re.escape(file_name)}(-[0-9]+)?$"
+    return {"user_id": user_id, "file_name": {"$regex": pattern}}
+
+
+def numbered_file_name(file_name, count):
+    return f'{file_name}-{count}' if count else file_name
+
+
+def file_names_page_query(user_id, after=None):
+    query = {"user_id": user_id}
+    if after:
+        query["file_name"] = {"$gt": after}
+    return query
+
+
+def allocate_file_name(collection, user_id, file_name, offset=0):
+    """
+    Pick the next free name for a user's file: file_name, then file_name-1, file_name-2, ...
+    """
+    count = collection.count_documents(
+        file_name_query(user_id, file_name)) + offset
+    return numbered_file_name(file_name, count)
+
+
+def summary_hash(summary):
+    return hashlib.sha256(summary.encode("utf-8")).hexdigest()
+
+
+def summary_blob_doc(summary):
+    """
+    Build the content addressed, zlib compressed SummaryBlobs document for a summary.
+    """
+    return {"_id": summary_hash(summary), "data": Binary(zlib.compress(summary.encode("utf-8"))),
+            "size": len(summary)}
+
+
+def decompress_summary_blob(blob):
+    return zlib.decompress(blob["data"]).decode("utf-8") if blob else None
+
+
+def save_summary_blob(summary):
+    """
+    Store a summary in the SummaryBlobs collection, identical summaries are stored once.
+
+    :return: The hash referencing the summary.
+    """
+    blob = summary_blob_doc(summary)
+    collection = connect_to_mongodb_collection("SummaryBlobs")
+    collection.update_one({"_id": blob["_id"]}, {
+                          "$setOnInsert": blob}, upsert=True)
+    return blob["_id"]
+
+
+def get_summary_blob(summary_hash):
+    try:
+        collection = connect_to_mongodb_collection("SummaryBlobs")
+        return decompress_summary_blob(collection.find_one({"_id": summary_hash}))
+    except Exception as e:
+        print("Error in reading summary from DB", e)
+        return None
+
+
+def saveUserFileDetailsToDb(user_id, data, max_attempts=5):
+    try:
+        # Only the hash is kept with the file metadata, the summary itself goes to SummaryBlobs.
         doc = {"user_id": user_id, 'file_name': data["file_name"],
-               'summary': data["summary"]}
+               'summary_hash': save_summary_blob(data["summary"])}
         file_name = doc["file_name"]
 
         collection = connect_to_mongodb_collection("UserFileDetails")
-        result = collection.find({"file_name": file_name})
-        count = result.count()
-        if count:
-            _file_name = f'{file_name}-{count}'
-            doc['file_name'] = _file_name
-        saveDocumentToDb("UserFileDetails", doc)
+        # The unique (user_id, file_name) index makes the insert the atomic step,
+        # a concurrent upload that took the same name makes us pick the next one.
+        for attempt in range(max_attempts):
+            doc['file_name'] = allocate_file_name(
+                collection, user_id, file_name, attempt)
+            try:
+                collection.insert_one(doc)
+                return doc['file_name']
+            except DuplicateKeyError:
+                doc.pop("_id", None)
+        print("Could not allocate a file name for", file_name)
+        return None
     except Exception as e:
         print("Error in Storing user to DB", e)
         return None
 
 
-def get_user_file_details(user_id):
+def get_user_file_details(user_id, limit=100, after=None):
+    """
+    List a page of a user's file names, sorted by name. Only file names are read, the query is covered by the index.
+
+    :param limit: The maximum number of file names to return.
+
+    :param after: Only return file names after this one, the last name of the previous page.
+    """
     try:
         collection = connect_to_mongodb_collection("UserFileDetails")
-        result = collection.find({"user_id": user_id})
-        return result
+        result = collection.find(file_names_page_query(user_id, after), FILE_NAMES_PROJECTION).sort(
+            FILE_NAMES_SORT).limit(limit)
+        return list(result)
     except Exception as e:
         print("Error in Storing user to DB", e)
         return None
 
 
 def get_user_file_summary(user_id, file_name):
+    """
+    Get the summary reference of a user's file. The summary text is fetched separately with get_summary_blob.
+    """
     try:
         collection = connect_to_mongodb_collection("UserFileDetails")
         result = collection.find_one(
-            {"user_id": user_id, "file_name": file_name})
+            {"user_id": user_id, "file_name": file_name}, FILE_SUMMARY_PROJECTION)
+        if result and "summary_hash" not in result and result.get("summary") is not None:
+            result["summary_hash"] = summary_hash(result["summary"])
         return result
     except Exception as e:
         print("Error in Storing user to DB", e)
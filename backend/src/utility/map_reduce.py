@@ -0,0 +1,245 @@
+"""
+The map and reduce phases of the map-reduce summarizer, run on asyncio.
+
+Every chunk is summarized with the chain's async API. MAP_CONCURRENCY bounds the calls in flight per document
+and every call waits for the process wide LLM rate limiter, which is shared by all uploads summarized at the
+same time. Each call is cancelled after MAP_CALL_TIMEOUT seconds and a failed chunk is retried up to
+MAP_MAX_ATTEMPTS times, results are kept in chunk order and failures are reported instead of dropped.
+Map outputs too long for one combine call are reduced as a tree: consecutive outputs are grouped into token
+bounded batches, the batches are reduced concurrently and this repeats until everything fits the budget.
+A reduce batch that keeps failing is dropped and reported like a failed chunk.
+"""
+import os
+import time
+import asyncio
+import threading
+
+from dotenv import load_dotenv
+from langchain.schema import Document
+
+load_dotenv()
+
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", 8))
+MAP_CALL_TIMEOUT = float(os.getenv("MAP_CALL_TIMEOUT", 120))
+MAP_MAX_ATTEMPTS = int(os.getenv("MAP_MAX_ATTEMPTS", 3))
+# Output tokens of each intermediate reduce call, also reserved for the final combine call.
+REDUCE_OUTPUT_TOKENS = int(os.getenv("REDUCE_OUTPUT_TOKENS", 1000))
+# 0 disables the limiter.
+LLM_REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", 500))
+
+
+class RateLimiter:
+    """
+    Space calls evenly to stay under a requests per minute budget.
+    The schedule is guarded by a thread lock, so jobs running their own event loops in different threads share it.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Reserve the next free slot.
+
+        :return: The number of seconds to wait before the slot starts.
+        """
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        return slot - now
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+llm_rate_limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE)
+
+
+async def _summarize_chunk(chain, doc, semaphore, timeout, max_attempts):
+    for attempt in range(max_attempts):
+        try:
+            async with semaphore:
+                await llm_rate_limiter.acquire()
+                return await asyncio.wait_for(chain.arun([doc]), timeout)
+        except Exception:
+            if attempt == max_attempts - 1:
+                raise
+        # Back off outside the semaphore so the other chunks keep going.
+        await asyncio.sleep(min(0.5 * 2 ** attempt, 10))
+
+
+async def amap_summaries(summary_docs, chain, concurrency=MAP_CONCURRENCY, timeout=MAP_CALL_TIMEOUT,
+                         max_attempts=MAP_MAX_ATTEMPTS, progress=None, on_summary=None):
+    """
+    Summarize every document with the chain concurrently.
+
+    :param summary_docs: A list of loaded langchain Document objects to summarize.
+
+    :param chain: A langchain summarize chain to use for summarization.
+
+    :param concurrency: The maximum number of calls in flight for this list.
+
+    :param timeout: The number of seconds after which a call is cancelled.
+
+    :param max_attempts: The number of attempts per document.
+
+    :param progress: An optional progress(event, data) callback, called with a "map" event as each document finishes.
+
+    :param on_summary: An optional on_summary(position, summary) callback, called as soon as a document is summarized.
+
+    :return: A list with a summary or the last raised exception per document, in the order of summary_docs.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    done = 0
+
+    async def summarize(position, doc):
+        nonlocal done
+        try:
+            summary = await _summarize_chunk(chain, doc, semaphore, timeout, max_attempts)
+            if on_summary:
+                on_summary(position, summary)
+            return summary
+        finally:
+            done += 1
+            if progress:
+                progress("map", {"done": done, "total": len(summary_docs)})
+
+    return await asyncio.gather(*(summarize(position, doc) for position, doc in enumerate(summary_docs)),
+                                return_exceptions=True)
+
+
+def map_summaries(summary_docs, chain, concurrency=MAP_CONCURRENCY, timeout=MAP_CALL_TIMEOUT,
+                  max_attempts=MAP_MAX_ATTEMPTS, progress=None, on_summary=None):
+    """
+    Run amap_summaries to completion from synchronous code, such as the upload job threads.
+    """
+    return asyncio.run(amap_summaries(summary_docs, chain, concurrency, timeout, max_attempts, progress,
+                                      on_summary))
+
+
+def coverage_report(results):
+    """
+    Summarize which chunks of a map phase succeeded.
+
+    :param results: The list returned by map_summaries.
+
+    :return: A dict with the number of chunks, summarized chunks, the failed chunk positions and the coverage ratio.
+    """
+    failed = [i for i, result in enumerate(results)
+              if isinstance(result, BaseException)]
+    total = len(results)
+    return {"chunks": total, "summarized": total - len(failed), "failed_chunks": failed,
+            "coverage": (total - len(failed)) / total if total else 0.0}
+
+
+def token_batches(counts, budget):
+    """
+    Group consecutive items into batches whose token counts add up to at most budget.
+    An item larger than the budget gets a batch of its own.
+
+    :param counts: The token count of each item, in order.
+
+    :param budget: The maximum number of tokens per batch.
+
+    :return: A list of lists of item positions.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for i, count in enumerate(counts):
+        if batch and batch_tokens + count > budget:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += count
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def check_reduce_budget(budget, output_tokens=REDUCE_OUTPUT_TOKENS):
+    """
+    Make sure a reduce level can always shrink: a batch must hold at least two reduced summaries.
+
+    :param budget: The maximum number of tokens of the joined summaries.
+
+    :param output_tokens: The maximum number of output tokens of one reduce call.
+    """
+    if budget < 2 * (output_tokens + 1):
+        raise ValueError(f"A reduce budget of {budget} tokens cannot hold two reduced summaries of "
+                         f"{output_tokens} tokens, lower REDUCE_OUTPUT_TOKENS or use a larger model")
+
+
+async def atree_reduce(summaries, chain, count_fn, budget, concurrency=MAP_CONCURRENCY, timeout=MAP_CALL_TIMEOUT,
+                       max_attempts=MAP_MAX_ATTEMPTS, progress=None, output_tokens=REDUCE_OUTPUT_TOKENS,
+                       report=None):
+    """
+    Reduce summaries level by level until their joined text fits in budget tokens.
+    A batch that still fails after max_attempts is dropped from the level instead of failing the whole reduce.
+
+    :param summaries: A list of summary strings, in document order.
+
+    :param chain: A langchain summarize chain whose output is at most output_tokens tokens.
+
+    :param count_fn: A function counting the tokens of a string.
+
+    :param budget: The maximum number of tokens of the joined summaries, at least twice output_tokens.
+
+    :param progress: An optional progress(event, data) callback, called with a "reduce" event after each level.
+
+    :param output_tokens: The maximum number of output tokens of one reduce call.
+
+    :param report: An optional dict updated with the number of failed batches and the share of summaries kept.
+
+    :return: A list of summary strings, in document order, whose joined text fits the budget.
+    """
+    check_reduce_budget(budget, output_tokens)
+    level = list(summaries)
+    # How many of the input summaries each summary of the level stands for.
+    weights = [1] * len(level)
+    # The newline joining two summaries counts as a token.
+    counts = [count_fn(summary) + 1 for summary in level]
+    failed_batches = 0
+    while sum(counts) > budget:
+        batches = token_batches(counts, budget)
+        semaphore = asyncio.Semaphore(concurrency)
+        results = await asyncio.gather(*(
+            _summarize_chunk(chain, Document(page_content='\n'.join(level[i] for i in batch)),
+                             semaphore, timeout, max_attempts)
+            for batch in batches), return_exceptions=True)
+        next_level, next_weights = [], []
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                failed_batches += 1
+                print(f"Reduce batch of {len(batch)} summaries failed: {result!r}")
+                continue
+            next_level.append(result)
+            next_weights.append(sum(weights[i] for i in batch))
+        if not next_level:
+            raise RuntimeError("Every reduce batch failed")
+        next_counts = [count_fn(summary) + 1 for summary in next_level]
+        # Reduce calls that do not respect output_tokens could otherwise loop forever.
+        if len(next_level) >= len(level) and sum(next_counts) >= sum(counts):
+            raise RuntimeError(f"Reduce level did not shrink {len(level)} summaries of {sum(counts)} tokens")
+        level, weights, counts = next_level, next_weights, next_counts
+        print(f"Reduced {len(batches)} batches into {len(level)} summaries of {sum(counts)} tokens")
+        if progress:
+            progress("reduce", {"summaries": len(level), "tokens": sum(counts)})
+    if report is not None:
+        report["reduce_failed_batches"] = failed_batches
+        report["reduce_coverage"] = sum(weights) / len(summaries) if summaries else 0.0
+    return level
+
+
+def tree_reduce(summaries, chain, count_fn, budget, concurrency=MAP_CONCURRENCY, timeout=MAP_CALL_TIMEOUT,
+                max_attempts=MAP_MAX_ATTEMPTS, progress=None, output_tokens=REDUCE_OUTPUT_TOKENS, report=None):
+    """
+    Run atree_reduce to completion from synchronous code.
+    """
+    return asyncio.run(atree_reduce(summaries, chain, count_fn, budget, concurrency, timeout, max_attempts,
+                                    progress, output_tokens, report))
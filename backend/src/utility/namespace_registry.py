@@ -0,0 +1,112 @@
+"""
+An in-process cache of the indexes and namespaces of the vector store.
+
+Questions and uploads only need to know whether an index or a namespace exists, which used to cost a
+list_indexes or describe_index_stats round trip per request. The namespaces of an index are now fetched
+at most once per NAMESPACE_CACHE_TTL seconds, and our own upserts and deletes update the cache directly.
+A namespace missing from the cache triggers one early refresh, at most every NAMESPACE_MISS_TTL seconds,
+so namespaces written by another process are still found quickly.
+"""
+import os
+import time
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+NAMESPACE_CACHE_TTL = float(os.getenv("NAMESPACE_CACHE_TTL", 300))
+NAMESPACE_MISS_TTL = float(os.getenv("NAMESPACE_MISS_TTL", 30))
+
+_lock = threading.Lock()
+_known_indexes = set()
+# index name -> (fetched_at, set of namespaces)
+_namespaces = {}
+
+
+def ensure_index(index_name, create_fn):
+    """
+    Make sure an index exists, calling create_fn (which checks and creates it) only the first time per process.
+
+    :param index_name: The name of the index.
+
+    :param create_fn: A function taking the index name and creating the index if missing.
+    """
+    with _lock:
+        if index_name in _known_indexes:
+            return
+    create_fn(index_name)
+    with _lock:
+        _known_indexes.add(index_name)
+
+
+def _refresh(index, index_name):
+    namespaces = set(index.describe_index_stats()["namespaces"].keys())
+    with _lock:
+        _namespaces[index_name] = (time.monotonic(), namespaces)
+    return namespaces
+
+
+def get_namespaces(index, index_name, max_age=NAMESPACE_CACHE_TTL):
+    """
+    Get the namespaces of an index, served from the cache when it is younger than max_age seconds.
+
+    :return: A set of namespace names.
+    """
+    with _lock:
+        cached = _namespaces.get(index_name)
+    if cached and time.monotonic() - cached[0] < max_age:
+        return cached[1]
+    return _refresh(index, index_name)
+
+
+def namespace_exists(index, index_name, namespace):
+    """
+    Check whether a namespace holds vectors without a control plane call in the common case.
+
+    :param index: The index handle, only used when the cache has to be refreshed.
+
+    :param index_name: The name of the index.
+
+    :param namespace: The namespace to look for.
+
+    :return: True if the namespace exists.
+    """
+    if namespace in get_namespaces(index, index_name):
+        return True
+    # The cache may predate an upsert from another process, refresh it early but not on every miss.
+    return namespace in get_namespaces(index, index_name, NAMESPACE_MISS_TTL)
+
+
+def register_namespace(index_name, namespace):
+    """
+    Record a namespace we just wrote to, so the next lookup does not have to wait for the TTL.
+    """
+    with _lock:
+        cached = _namespaces.get(index_name)
+        if cached:
+            cached[1].add(namespace)
+
+
+def invalidate(index_name, namespace=None):
+    """
+    Forget a deleted namespace, or everything cached about the index when namespace is None.
+    """
+    with _lock:
+        if namespace is None:
+            _namespaces.pop(index_name, None)
+            _known_indexes.discard(index_name)
+        elif index_name in _namespaces:
+            _namespaces[index_name][1].discard(namespace)
+
+
+def record_sync(index_name, namespace, stats):
+    """
+    Update the cache from the stats of sync_chunks or sync_sources for one namespace.
+    """
+    if not stats:
+        return
+    if stats["upserted"] or stats["skipped"]:
+        register_namespace(index_name, namespace)
+    elif stats["deleted"]:
+        invalidate(index_name, namespace)
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import pathlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# PDFs with at least this many pages are extracted across a process pool.
+PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGE_THRESHOLD", 64))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 16))
+EXTRACTED_TEXT_DIR = os.getenv(
+    "EXTRACTED_TEXT_DIR", str(pathlib.Path.home() / "extracted_text"))
+# Extracted texts not used for this many seconds are removed at startup.
+EXTRACTED_TEXT_MAX_AGE = int(os.getenv("EXTRACTED_TEXT_MAX_AGE", 7 * 24 * 3600))
+
+
+def _extract_page_range(file_location, start, end):
+    """
+    Extract the text of pages [start, end) of a PDF. Runs in a worker process.
+    """
+    reader = PdfReader(str(file_location))
+    return [reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+
+def _iter_pages_parallel(file_location, num_pages, max_workers):
+    ranges = [(start, min(start + PAGES_PER_TASK, num_pages))
+              for start in range(0, num_pages, PAGES_PER_TASK)]
+    # Only keep a bounded window of page ranges in flight so memory does not grow with the document.
+    window = max_workers * 2
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = [executor.submit(_extract_page_range, str(file_location), start, end)
+                   for start, end in ranges[:window]]
+        next_range = len(futures)
+        for i in range(len(ranges)):
+            pages = futures[i].result()
+            futures[i] = None
+            if next_range < len(ranges):
+                start, end = ranges[next_range]
+                futures.append(executor.submit(
+                    _extract_page_range, str(file_location), start, end))
+                next_range += 1
+            for page in pages:
+                yield page
+
+
+def iter_pdf_pages(pdf_file, max_workers=None):
+    """
+    Yield the text of each page of a PDF in page order.
+
+    :param pdf_file: The path of the PDF, or a file-like object.
+
+    :param max_workers: The number of worker processes to use for large PDFs.
+
+    :return: A generator of page texts.
+    """
+    reader = PdfReader(pdf_file)
+    num_pages = len(reader.pages)
+    max_workers = max_workers or PDF_EXTRACT_WORKERS
+    is_path = isinstance(pdf_file, (str, os.PathLike))
+    if is_path and max_workers > 1 and num_pages >= PARALLEL_PAGE_THRESHOLD:
+        del reader
+        yield from _iter_pages_parallel(pdf_file, num_pages, max_workers)
+        return
+    for page in reader.pages:
+        yield page.extract_text() or ''
+
+
+def extract_pdf_text(pdf_file, max_workers=None):
+    """
+    Extract the full text of a PDF.
+
+    :param pdf_file: The path of the PDF, or a file-like object.
+
+    :param max_workers: The number of worker processes to use for large PDFs.
+
+    :return: A string of text.
+    """
+    return ''.join(iter_pdf_pages(pdf_file, max_workers))
+
+
+def iter_split_pages(pages, splitter, window_pages=20):
+    """
+    Split a stream of page texts into chunks, holding only a window of pages in memory at a time.
+    The last chunk of each window is carried into the next one so chunks are not cut at window boundaries.
+
+    :param pages: An iterable of page texts.
+
+    :param splitter: A langchain text splitter.
+
+    :param window_pages: The number of pages to split at once.
+
+    :return: A generator of text chunks.
+    """
+    carry = ''
+    window = []
+    for page in pages:
+        window.append(page)
+        if len(window) < window_pages:
+            continue
+        chunks = splitter.split_text(carry + ''.join(window))
+        window = []
+        carry = chunks.pop() if chunks else ''
+        yield from chunks
+    chunks = splitter.split_text(carry + ''.join(window))
+    yield from chunks
+
+
+def _page_offsets_path(text_path):
+    return pathlib.Path(f"{text_path}.pages.json")
+
+
+def extract_to_text_file(file_location, document_hash, max_workers=None):
+    """
+    Extract a PDF once into a persisted text file with page offsets, keyed by the document hash.
+    Later calls for the same document reuse the file instead of parsing the PDF again.
+
+    :param file_location: The path of the PDF.
+
+    :param document_hash: The SHA-256 of the PDF bytes.
+
+    :param max_workers: The number of worker processes to use for large PDFs.
+
+    :return: The path of the extracted text file.
+    """
+    text_path = pathlib.Path(EXTRACTED_TEXT_DIR) / f"{document_hash}.txt"
+    offsets_path = _page_offsets_path(text_path)
+    # The offsets file is written last, so its presence means the text file is complete.
+    if offsets_path.exists():
+        try:
+            # A reused text is kept as long as the document keeps being uploaded
+            os.utime(offsets_path)
+            return str(text_path)
+        except FileNotFoundError:
+            pass
+    text_path.parent.mkdir(parents=True, exist_ok=True)
+    # Concurrent uploads of the same document each write their own temporary files, the last replace wins
+    fd, tmp_text_path = tempfile.mkstemp(dir=text_path.parent, suffix=".tmp")
+    offsets = [0]
+    with open(fd, "w", encoding="utf-8", newline="") as f:
+        for page in iter_pdf_pages(str(file_location), max_workers):
+            f.write(page)
+            offsets.append(offsets[-1] + len(page))
+    os.replace(tmp_text_path, text_path)
+    fd, tmp_offsets_path = tempfile.mkstemp(dir=text_path.parent, suffix=".tmp")
+    with open(fd, "w") as f:
+        json.dump(offsets, f)
+    os.replace(tmp_offsets_path, offsets_path)
+    return str(text_path)
+
+
+def prune_extracted_text(max_age=EXTRACTED_TEXT_MAX_AGE):
+    """
+    Remove the extracted texts, and the temporary files of interrupted extractions, unused for max_age seconds.
+    Must run while no upload job is running, such as at startup.
+    """
+    root = pathlib.Path(EXTRACTED_TEXT_DIR)
+    if not root.exists():
+        return
+    now = time.time()
+    for text_path in root.glob("*.txt"):
+        offsets_path = _page_offsets_path(text_path)
+        # Every reuse touches the offsets file, a text without one was never completed
+        used_path = offsets_path if offsets_path.exists() else text_path
+        try:
+            if now - used_path.stat().st_mtime > max_age:
+                # The offsets file goes first, a partly removed text is never taken as complete
+                offsets_path.unlink(missing_ok=True)
+                text_path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+    for tmp_path in root.glob("*.tmp"):
+        try:
+            if now - tmp_path.stat().st_mtime > max_age:
+                tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def load_page_offsets(text_path):
+    """
+    Load the character offsets of each page start in an extracted text file, followed by the total length.
+    """
+    with open(_page_offsets_path(text_path), "r") as f:
+        return json.load(f)
+
+
+def iter_extracted_pages(text_path):
+    """
+    Yield the pages of a text file written by extract_to_text_file, one page in memory at a time.
+
+    :param text_path: The path returned by extract_to_text_file.
+
+    :return: A generator of page texts.
+    """
+    offsets = load_page_offsets(text_path)
+    with open(text_path, "r", encoding="utf-8", newline="") as f:
+        for start, end in zip(offsets, offsets[1:]):
+            yield f.read(end - start)
@@ -0,0 +1,258 @@
+import os
+import time
+import hashlib
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from retrying import retry
+from dotenv import load_dotenv
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from backend.src.utility.embedding_batcher import EMBED_BATCH_MAX_ITEMS, embed_sources
+
+load_dotenv()
+
+UPSERT_BATCH_SIZE = int(os.getenv("PINECONE_UPSERT_BATCH_SIZE", 100))
+UPSERT_MAX_WORKERS = int(os.getenv("PINECONE_UPSERT_MAX_WORKERS", 4))
+UPSERT_MAX_ATTEMPTS = int(os.getenv("PINECONE_UPSERT_MAX_ATTEMPTS", 4))
+
+
+def get_text_splitter():
+    """
+    Get the splitter cutting indexed texts into chunks, shared by every index so their chunks match.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=400,
+        chunk_overlap=20,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+
+def chunk_id(prefix, chunk_index, chunk):
+    """
+    Build a deterministic vector ID from the ID prefix (by default the namespace), the chunk position and the chunk content.
+    Re-indexing the same text yields the same IDs, so upserts overwrite instead of duplicating.
+
+    :param prefix: The ID prefix, unique per indexed source within a namespace.
+
+    :param chunk_index: The position of the chunk in the source.
+
+    :param chunk: The chunk text.
+
+    :return: The vector ID.
+    """
+    content_hash = hashlib.sha256(chunk.encode("utf-8")).hexdigest()[:16]
+    return f"{prefix}#{chunk_index}#{content_hash}"
+
+
+def list_vector_ids(index, namespace, prefix):
+    """
+    List the IDs of the vectors already indexed for a prefix.
+
+    :return: A set of vector IDs, or None if the index does not support listing.
+    """
+    try:
+        ids = set()
+        for page in index.list(prefix=f"{prefix}#", namespace=namespace):
+            ids.update(page)
+        return ids
+    except Exception as e:
+        print(f"Could not list vector ids: {e}")
+        return None
+
+
+def build_vectors(ids, chunks, embeddings):
+    return [{'id': vector_id, 'values': embedding, 'metadata': {'text': chunk}}
+            for vector_id, chunk, embedding in zip(ids, chunks, embeddings)]
+
+
+def delete_vectors(index, namespace, ids, batch_size=1000):
+    ids = list(ids)
+    for start in range(0, len(ids), batch_size):
+        index.delete(ids=ids[start:start + batch_size], namespace=namespace)
+
+
+def _batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def is_transient_error(exc):
+    """
+    Whether a failed request is worth retrying: timeouts, connection errors, rate limiting (429) and server errors (5xx).
+    Other errors, e.g. a wrong dimension or bad credentials, fail the same way on every attempt.
+    """
+    response = getattr(exc, "response", None)
+    status = getattr(exc, "status", None) or getattr(exc, "status_code", None) or \
+        getattr(response, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # Covers socket and urllib3 failures and requests' ConnectionError/Timeout, which are OSErrors.
+    return isinstance(exc, (OSError, Urllib3HTTPError))
+
+
+def _upsert_batch(index, namespace, batch, max_attempts):
+    @retry(stop_max_attempt_number=max_attempts, wait_exponential_multiplier=500, wait_exponential_max=10000,
+           retry_on_exception=is_transient_error)
+    def upsert():
+        index.upsert(vectors=batch, namespace=namespace)
+    upsert()
+    return len(batch)
+
+
+def _collect(futures, stats):
+    for future in futures:
+        try:
+            stats["vectors"] += future.result()
+            stats["batches"] += 1
+        except Exception as e:
+            stats["failed_batches"] += 1
+            print(f"Error occurred while upserting into Pinecone: {e}")
+
+
+def upsert_vectors(index, namespace, vectors, batch_size=UPSERT_BATCH_SIZE, max_workers=UPSERT_MAX_WORKERS,
+                   max_attempts=UPSERT_MAX_ATTEMPTS):
+    """
+    Upsert vectors in batches sent concurrently by a bounded pool. Batches failing are retried with exponential backoff.
+    The vectors iterable is consumed lazily and at most 2 * max_workers batches are in flight, so a slow index holds back the producer.
+
+    :param index: The Pinecone Index to write to.
+
+    :param namespace: The namespace to write to.
+
+    :param vectors: An iterable of {'id', 'values', 'metadata'} dicts.
+
+    :param batch_size: The number of vectors per upsert request.
+
+    :param max_workers: The number of concurrent upsert requests.
+
+    :param max_attempts: The number of attempts per batch.
+
+    :return: A dict with the upserted vectors, batches, failed batches, seconds and vectors per second.
+    """
+    stats = {"vectors": 0, "batches": 0, "failed_batches": 0}
+    start = time.perf_counter()
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in _batched(vectors, batch_size):
+            if len(in_flight) >= max_workers * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                _collect(done, stats)
+            in_flight.add(executor.submit(
+                _upsert_batch, index, namespace, batch, max_attempts))
+        _collect(wait(in_flight)[0], stats)
+    stats["seconds"] = time.perf_counter() - start
+    stats["vectors_per_second"] = stats["vectors"] / \
+        stats["seconds"] if stats["seconds"] else 0.0
+    print(f"Upserted {stats['vectors']} vectors in {stats['batches']} batches "
+          f"({stats['vectors_per_second']:.1f} vectors/s, {stats['failed_batches']} failed batches)")
+    return stats
+
+
+def sync_chunks(index, namespace, chunks, embed_fn, prefix=None, batch_size=UPSERT_BATCH_SIZE, delete_stale=True,
+                embed_batch_size=EMBED_BATCH_MAX_ITEMS):
+    """
+    Idempotently index a stream of chunks: unchanged chunks are skipped without embedding,
+    new or changed chunks are embedded and upserted, and vectors of chunks that no longer exist are deleted.
+
+    :param index: The Pinecone Index to write to.
+
+    :param namespace: The namespace to write to.
+
+    :param chunks: An iterable of chunk texts, in source order.
+
+    :param embed_fn: A function embedding a list of strings into a list of vectors.
+
+    :param prefix: The ID prefix of the source, defaults to the namespace.
+
+    :param batch_size: The number of vectors upserted per request.
+
+    :param delete_stale: Whether to delete vectors of chunks that are no longer in the source.
+
+    :param embed_batch_size: The number of new chunks handed to embed_fn at once.
+
+    :return: A dict with the number of upserted, skipped and deleted vectors.
+    """
+    prefix = prefix or namespace
+    existing = list_vector_ids(index, namespace, prefix) or set()
+    stats = {"upserted": 0, "skipped": 0, "deleted": 0}
+    seen = set()
+
+    def new_vectors():
+        batch_ids, batch_chunks = [], []
+        for chunk_index, chunk in enumerate(chunks):
+            vector_id = chunk_id(prefix, chunk_index, chunk)
+            seen.add(vector_id)
+            if vector_id in existing:
+                stats["skipped"] += 1
+                continue
+            batch_ids.append(vector_id)
+            batch_chunks.append(chunk)
+            if len(batch_ids) == embed_batch_size:
+                yield from build_vectors(batch_ids, batch_chunks, embed_fn(batch_chunks))
+                batch_ids, batch_chunks = [], []
+        if batch_ids:
+            yield from build_vectors(batch_ids, batch_chunks, embed_fn(batch_chunks))
+
+    upsert_stats = upsert_vectors(index, namespace, new_vectors(), batch_size)
+    stats["upserted"] = upsert_stats["vectors"]
+    stats["failed_batches"] = upsert_stats["failed_batches"]
+
+    stale = existing - seen
+    # Only garbage collect once everything was written, a failed batch must not lose vectors.
+    if delete_stale and stale and not upsert_stats["failed_batches"]:
+        delete_vectors(index, namespace, stale)
+        stats["deleted"] = len(stale)
+    return stats
+
+
+def sync_sources(index, sources, embed_fn, batch_size=UPSERT_BATCH_SIZE, delete_stale=True):
+    """
+    Idempotently index several sources at once, like sync_chunks, but the new chunks of all sources are embedded together
+    so many small documents or QA items share the same embedding requests.
+
+    :param index: The Pinecone Index to write to.
+
+    :param sources: A list of (namespace, prefix, chunks) tuples, prefix defaults to the namespace when None.
+
+    :param embed_fn: A function embedding a list of strings into a list of vectors.
+
+    :param batch_size: The number of vectors upserted per request.
+
+    :param delete_stale: Whether to delete vectors of chunks that are no longer in their source.
+
+    :return: A list with a stats dict per source, in the order of sources.
+    """
+    pending = {}
+    results = []
+    for position, (namespace, prefix, chunks) in enumerate(sources):
+        prefix = prefix or namespace
+        existing = list_vector_ids(index, namespace, prefix) or set()
+        ids = [chunk_id(prefix, i, chunk) for i, chunk in enumerate(chunks)]
+        new = [(vector_id, chunk) for vector_id, chunk in zip(ids, chunks)
+               if vector_id not in existing]
+        pending[position] = new
+        results.append({"upserted": 0, "skipped": len(ids) - len(new), "deleted": 0,
+                        "stale": existing - set(ids)})
+
+    vectors = embed_sources({position: [chunk for _, chunk in new] for position, new in pending.items()},
+                            embed_fn)
+
+    for position, (namespace, _, _) in enumerate(sources):
+        stats = results[position]
+        stale = stats.pop("stale")
+        new = pending[position]
+        upsert_stats = upsert_vectors(index, namespace, build_vectors(
+            [vector_id for vector_id, _ in new], [chunk for _, chunk in new], vectors[position]), batch_size)
+        stats["upserted"] = upsert_stats["vectors"]
+        stats["failed_batches"] = upsert_stats["failed_batches"]
+        if delete_stale and stale and not upsert_stats["failed_batches"]:
+            delete_vectors(index, namespace, stale)
+            stats["deleted"] = len(stale)
+    return results
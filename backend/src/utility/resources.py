@@ -0,0 +1,80 @@
+"""
+Process wide API handles: the OpenAI client and its cached embedder, vector store index handles and the question
+answering chain.
+
+Every handle is created on first use and then shared by all call sites, so their HTTP connection pools stay
+warm between requests and a question does not pay for building clients, index handles or chains.
+"""
+import os
+import threading
+from functools import lru_cache
+
+from openai import OpenAI
+from dotenv import load_dotenv
+
+from backend.src.utility.vector_store import get_vector_client
+from backend.src.utility.embedding_cache import get_embeddings
+from backend.src.utility.embedding_batcher import embed_batched
+
+load_dotenv()
+
+# The model of every vector index, questions must be embedded with it too.
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+_index_lock = threading.Lock()
+_indexes = {}
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """
+    Get the shared OpenAI client, its httpx pool keeps connections alive across requests.
+    """
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+def _embed_request(texts):
+    response = get_openai_client().embeddings.create(
+        input=texts, model=EMBEDDING_MODEL)
+    return [item.embedding for item in response.data]
+
+
+def embed_texts(texts):
+    """
+    Embed texts with EMBEDDING_MODEL. Cached texts cost no API call, the others are packed into as few
+    requests as the batch limits allow and sent concurrently.
+
+    :param texts: A list of strings to embed.
+
+    :return: A list of vectors in the same order as texts.
+    """
+    return get_embeddings(texts, EMBEDDING_MODEL, lambda missing: embed_batched(missing, _embed_request))
+
+
+def get_index(index_name):
+    """
+    Get the shared handle of a vector store index.
+
+    :param index_name: The name of the index.
+
+    :return: A Pinecone Index or a LocalIndex.
+    """
+    with _index_lock:
+        if index_name not in _indexes:
+            _indexes[index_name] = get_vector_client().Index(index_name)
+        return _indexes[index_name]
+
+
+@lru_cache(maxsize=None)
+def get_qa_llm():
+    from langchain.llms import OpenAI as OpenAILLM
+    return OpenAILLM()
+
+
+@lru_cache(maxsize=None)
+def get_qa_chain():
+    """
+    Get the shared "stuff" question answering chain. It holds no per question state, so it is safe to reuse.
+    """
+    from langchain.chains.question_answering import load_qa_chain
+    return load_qa_chain(get_qa_llm(), chain_type="stuff")
@@ -1,10 +1,10 @@
 from langchain.document_loaders import TextLoader, YoutubeLoader
-from langchain.text_splitter import TokenTextSplitter
 from langchain.schema import Document
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.prompts import PromptTemplate
 from langchain.chains.summarize import load_summarize_chain
+from langchain.callbacks.base import BaseCallbackHandler
 
 # import streamlit as st
 
@@ -14,13 +14,19 @@ import tiktoken
 
 import numpy as np
 
-from backend.src.utility.elbow import calculate_inertia, determine_optimal_clusters
+from backend.src.utility.elbow import select_kmeans
+from backend.src.utility.embedding_cache import get_embeddings
+from backend.src.utility.embedding_batcher import embed_batched
+from backend.src.utility.text_cleaning import scrub_pages, scrub_special_tokens
+from backend.src.utility.token_splitter import to_token_array, chunk_size_for, split_token_array
+from backend.src.utility.map_reduce import map_summaries, coverage_report, tree_reduce, check_reduce_budget, \
+    MAP_CONCURRENCY, REDUCE_OUTPUT_TOKENS
 
 import time
 
 import urllib.parse
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 
 
 def doc_loader(file_path: str):
@@ -35,6 +41,29 @@ def doc_loader(file_path: str):
     return loader.load()
 
 
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name='cl100k_base'):
+    """
+    Load a tiktoken encoding once per process.
+
+    :param encoding_name: The name of the encoding to load.
+
+    :return: A tiktoken Encoding object.
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
+def encode_text(text: str):
+    """
+    Tokenize a string of text.
+
+    :param text: The text to tokenize.
+
+    :return: A list of token ids.
+    """
+    return get_encoding().encode(text, disallowed_special=())
+
+
 def token_counter(text: str):
     """
     Count the number of tokens in a string of text.
@@ -43,10 +72,34 @@ def token_counter(text: str):
 
     :return: The number of tokens in the text.
     """
-    encoding = tiktoken.get_encoding('cl100k_base')
-    token_list = encoding.encode(text, disallowed_special=())
-    tokens = len(token_list)
-    return tokens
+    return len(encode_text(text))
+
+
+def tokenize_doc(document):
+    """
+    Convert a langchain Document object into text and tokenize it once, so the tokens can be reused for validation and splitting.
+
+    :param document: The loaded langchain Document object to tokenize.
+
+    :return: A tuple of the text and a NumPy array of its token ids.
+    """
+    text, removed = clean_doc_text(document)
+    if removed:
+        print(f'Removed {removed} special tokens')
+    return text, to_token_array(encode_text(text))
+
+
+def clean_doc_text(document):
+    """
+    Convert a langchain Document object into a string of text with special tokens removed and whitespace collapsed.
+
+    :param document: The loaded langchain Document object to convert.
+
+    :return: A tuple of the text and the number of special tokens removed.
+    """
+    text, removed = scrub_pages(page.page_content for page in document)
+    text = ' '.join(text.split())
+    return text, removed
 
 
 def doc_to_text(document):
@@ -57,25 +110,13 @@ def doc_to_text(document):
 
     :return: A string of text.
     """
-    text = ''
-    for i in document:
-        text += i.page_content
-    special_tokens = ['>|endoftext|', '<|fim_prefix|',
-                      '<|fim_middle|', '<|fim_suffix|', '<|endofprompt|']
-    words = text.split()
-    filtered_words = [word for word in words if word not in special_tokens]
-    text = ' '.join(filtered_words)
+    text, _ = clean_doc_text(document)
     return text
 
 
 def remove_special_tokens(docs):
-    special_tokens = ['>|endoftext|', '<|fim_prefix|',
-                      '<|fim_middle|', '<|fim_suffix|', '<|endofprompt|>']
     for doc in docs:
-        content = doc.page_content
-        for special in special_tokens:
-            content = content.replace(special, '')
-            doc.page_content = content
+        doc.page_content, _ = scrub_special_tokens(doc.page_content)
     return docs
 
 
@@ -91,7 +132,9 @@ def embed_docs_openai(docs, api_key):
     """
     docs = remove_special_tokens(docs)
     embeddings = OpenAIEmbeddings(openai_api_key=api_key)
-    vectors = embeddings.embed_documents([x.page_content for x in docs])
+    # Cache misses are packed into token bounded requests that are sent concurrently.
+    vectors = get_embeddings([x.page_content for x in docs], embeddings.model,
+                             lambda texts: embed_batched(texts, embeddings.embed_documents))
     return vectors
 
 
@@ -106,33 +149,53 @@ def kmeans_clustering(vectors, num_clusters=None):
     :return: A K-Means clustering object.
     """
     if num_clusters is None:
-        inertia_values = calculate_inertia(vectors)
-        num_clusters = determine_optimal_clusters(inertia_values)
-        print(f'Optimal number of clusters: {num_clusters}')
+        return select_kmeans(vectors)
 
     kmeans = KMeans(n_clusters=num_clusters, random_state=42).fit(vectors)
     return kmeans
 
 
-def get_closest_vectors(vectors, kmeans):
+def get_closest_vectors(vectors, kmeans, top_n=1, deduplicate=True):
     """
     Get the closest vectors to the cluster centers of a K-Means clustering object.
 
-    :param vectors: A list of vectors to cluster.
+    :param vectors: A list or float32 array of vectors to cluster.
 
     :param kmeans: A K-Means clustering object.
 
+    :param top_n: The number of representative vectors to pick per cluster.
+
+    :param deduplicate: Whether a vector closest to several centers is only picked once, the other centers falling back to their next closest vector.
+
     :return: A list of indices of the closest vectors to the cluster centers.
     """
-    closest_indices = []
-    for i in range(len(kmeans.cluster_centers_)):
-        distances = np.linalg.norm(
-            vectors - kmeans.cluster_centers_[i], axis=1)
-        closest_index = np.argmin(distances)
-        closest_indices.append(closest_index)
-
-    selected_indices = sorted(closest_indices)
-    return selected_indices
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centers = np.asarray(kmeans.cluster_centers_, dtype=np.float32)
+    # Squared euclidean distances of every vector to every center, shape (n_vectors, n_centers).
+    distances = (np.einsum('ij,ij->i', vectors, vectors)[:, None]
+                 - 2 * vectors @ centers.T
+                 + np.einsum('ij,ij->i', centers, centers)[None, :])
+    top_n = min(top_n, len(vectors))
+
+    if not deduplicate:
+        closest = np.argsort(distances, axis=0, kind='stable')[:top_n]
+        return sorted(int(i) for i in closest.ravel())
+
+    # Greedily hand out vectors in order of distance so each center gets its nearest unused vectors.
+    wanted = min(top_n * len(centers), len(vectors))
+    taken = np.zeros(len(vectors), dtype=bool)
+    picked_per_center = np.zeros(len(centers), dtype=int)
+    selected_indices = []
+    for flat_index in np.argsort(distances, axis=None, kind='stable'):
+        vector_index, center_index = divmod(int(flat_index), len(centers))
+        if taken[vector_index] or picked_per_center[center_index] >= top_n:
+            continue
+        taken[vector_index] = True
+        picked_per_center[center_index] += 1
+        selected_indices.append(vector_index)
+        if len(selected_indices) == wanted:
+            break
+    return sorted(selected_indices)
 
 
 def map_vectors_to_docs(indices, docs):
@@ -164,7 +227,8 @@ def create_summarize_chain(prompt_list):
     return chain
 
 
-def parallelize_summaries(summary_docs, initial_chain, max_workers=4):
+def parallelize_summaries(summary_docs, initial_chain, concurrency=MAP_CONCURRENCY, report=None, progress=None,
+                          checkpoint=None):
     """
     Summarize a list of loaded langchain Document objects using multiple langchain summarize chains in parallel.
 
@@ -172,38 +236,53 @@ def parallelize_summaries(summary_docs, initial_chain, max_workers=4):
 
     :param initial_chain: A langchain summarize chain to use for summarization.
 
-    :param progress_bar: A streamlit progress bar to display the progress of the summarization.
+    :param concurrency: The maximum number of summarize calls in flight, calls are also rate limited process wide.
 
-    :param max_workers: The maximum number of workers to use for parallelization.
+    :param report: An optional dict updated with the coverage of the map phase.
 
-    :return: A list of summaries.
+    :param progress: An optional progress(event, data) callback, called as each document finishes.
+
+    :param checkpoint: An optional PipelineCheckpoint, documents summarized by an earlier run are not summarized again.
+
+    :return: A list with the summary of each document in document order, None where a document failed after retries.
     """
+    done = checkpoint.load_map() if checkpoint else {}
+    pending = [i for i in range(len(summary_docs)) if i not in done]
+    on_summary = None
+    if checkpoint:
+        def on_summary(position, summary):
+            checkpoint.save_map(pending[position], summary)
     try:
-        doc_summaries = []
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_doc = {executor.submit(
-                initial_chain.run, [doc]): doc.page_content for doc in summary_docs}
-
-            for future in as_completed(future_to_doc):
-                doc = future_to_doc[future]
-
-                try:
-                    summary = future.result()
-
-                except Exception as exc:
-                    print(f'{doc} generated an exception: {exc}')
-
-                else:
-                    doc_summaries.append(summary)
-                    num = (len(doc_summaries)) / (len(summary_docs) + 1)
-                    # Remove this line and all references to it if you are not using Streamlit.
-                    # progress_bar.progress(num)
-        return doc_summaries
+        pending_results = map_summaries([summary_docs[i] for i in pending], initial_chain, concurrency,
+                                        progress=progress, on_summary=on_summary)
     except Exception as e:
         print(str(e))
+        pending_results = [e] * len(pending)
+    results = [done.get(i) for i in range(len(summary_docs))]
+    for i, result in zip(pending, pending_results):
+        results[i] = result
+    coverage = coverage_report(results)
+    for i in coverage["failed_chunks"]:
+        print(f'Chunk {i} generated an exception: {results[i]!r}')
+    if report is not None:
+        report.update(coverage)
+    return [None if isinstance(summary, BaseException) else summary for summary in results]
+
+
+class ProgressTokenHandler(BaseCallbackHandler):
+    """
+    Forward the tokens of a streaming llm to a progress(event, data) callback as "token" events.
+    """
+
+    def __init__(self, progress):
+        self.progress = progress
 
+    def on_llm_new_token(self, token, **kwargs):
+        self.progress("token", {"text": token})
 
-def create_summary_from_docs(summary_docs, initial_chain, final_sum_list, api_key, use_gpt_4):
+
+def create_summary_from_docs(summary_docs, initial_chain, final_sum_list, api_key, use_gpt_4, report=None, progress=None,
+                             checkpoint=None):
     """
     Summarize a list of loaded langchain Document objects using multiple langchain summarize chains.
 
@@ -217,45 +296,85 @@ def create_summary_from_docs(summary_docs, initial_chain, final_sum_list, api_ke
 
     :param use_gpt_4: Whether to use GPT-4 or GPT-3.5-turbo for summarization.
 
-    :return: A string containing the summary.
-    """
-    try:
+    :param report: An optional dict updated with the coverage of the map and reduce phases.
 
-        # progress = st.progress(0)  # Create a progress bar to show the progress of summarization.
-        # Remove this line and all references to it if you are not using Streamlit.
+    :param progress: An optional progress(event, data) callback receiving map progress and the final summary tokens.
 
-        doc_summaries = parallelize_summaries(summary_docs, initial_chain)
-
-        summaries = '\n'.join(doc_summaries)
-        count = token_counter(summaries)
+    :param checkpoint: An optional PipelineCheckpoint to resume the map and reduce stages from.
 
+    :return: A string containing the summary.
+    """
+    try:
         if use_gpt_4:
-            max_tokens = 7500 - int(count)
+            token_budget = 7500
             model = 'gpt-4'
 
         else:
-            max_tokens = 3800 - int(count)
+            token_budget = 3800
             model = 'gpt-3.5-turbo'
 
+        # Map outputs that do not leave room for the prompt and the final summary are reduced as a tree first,
+        # a budget too small for that fails here before any chunk is summarized
+        input_budget = token_budget - \
+            token_counter(final_sum_list[0]) - REDUCE_OUTPUT_TOKENS
+        check_reduce_budget(input_budget)
+
+        reduced = checkpoint.load("reduced") if checkpoint else None
+        complete = reduced is not None
+        if reduced is None:
+            doc_summaries = parallelize_summaries(
+                summary_docs, initial_chain, report=report, progress=progress, checkpoint=checkpoint)
+            complete = all(summary is not None for summary in doc_summaries)
+            # Keep the document order and combine whatever succeeded
+            doc_summaries = [summary for summary in doc_summaries if summary]
+            if not doc_summaries:
+                print("No chunk could be summarized")
+                return None
+        else:
+            doc_summaries = reduced
+
+        if reduced is None and sum(token_counter(summary) + 1 for summary in doc_summaries) > input_budget:
+            reduce_chain = create_summarize_chain([final_sum_list[0], final_sum_list[1], ChatOpenAI(
+                openai_api_key=api_key, temperature=0, max_tokens=REDUCE_OUTPUT_TOKENS, model_name=model)])
+            reduce_report = {}
+            doc_summaries = tree_reduce(
+                doc_summaries, reduce_chain, token_counter, input_budget, progress=progress, report=reduce_report)
+            # Summaries dropped by failed reduce batches count against the coverage like failed chunks
+            if reduce_report["reduce_failed_batches"]:
+                complete = False
+            if report is not None:
+                report.update(reduce_report)
+                report["coverage"] = report.get("coverage", 1.0) * reduce_report["reduce_coverage"]
+        # Only a complete map and reduce is checkpointed past this point, a rerun retries the failed calls
+        if checkpoint and complete and reduced is None:
+            checkpoint.save("reduced", doc_summaries)
+
+        summaries = '\n'.join(doc_summaries)
+        count = token_counter(summaries)
+        max_tokens = token_budget - int(count)
+
+        # With a progress callback the final summary is streamed token by token as it is generated
         final_sum_list[2] = ChatOpenAI(
-            openai_api_key=api_key, temperature=0, max_tokens=max_tokens, model_name=model)
+            openai_api_key=api_key, temperature=0, max_tokens=max_tokens, model_name=model,
+            streaming=progress is not None, callbacks=[ProgressTokenHandler(progress)] if progress else None)
         print("inside create_summary_from_docs=====>>>>>>>")
         final_sum_chain = create_summarize_chain(final_sum_list)
         summaries = Document(page_content=summaries)
+        if progress:
+            progress("combine", {"tokens": count})
         final_summary = final_sum_chain.run([summaries])
-
-        # progress.progress(1.0)  # Remove this line and all references to it if you are not using Streamlit.
-        # time.sleep(0.4)  # Remove this line and all references to it if you are not using Streamlit.
-        # progress.empty()  # Remove this line and all references to it if you are not using Streamlit.
-
+        if checkpoint and complete:
+            checkpoint.save("final", final_summary)
         return final_summary
     except Exception as e:
         print(str(e))
 
 
-def split_by_tokens(doc, num_clusters, ratio=5, minimum_tokens=200, maximum_tokens=2000):
+def split_by_tokens(doc, num_clusters, ratio=5, minimum_tokens=200, maximum_tokens=2000, tokens=None):
     """
     Split a  langchain Document object into a list of smaller langchain Document objects.
+    Chunks are cut from the cl100k_base tokens the chunk size is computed from. TokenTextSplitter, used before,
+    cut them from its default gpt2 tokens, so chunk boundaries, sizes and counts differ from that splitter.
 
     :param doc: The langchain Document object to split.
 
@@ -267,25 +386,25 @@ def split_by_tokens(doc, num_clusters, ratio=5, minimum_tokens=200, maximum_toke
 
     :param maximum_tokens: The maximum number of tokens to use for splitting.
 
-    :return: A list of langchain Document objects.
+    :param tokens: The token ids of the document, if already computed.
+
+    :return: A sequence of langchain Document objects.
     """
     try:
-        text_doc = doc_to_text(doc)
-        tokens = token_counter(text_doc)
-        chunks = num_clusters * ratio
-        max_tokens = int(tokens / chunks)
-        max_tokens = max(minimum_tokens, min(max_tokens, maximum_tokens))
-        overlap = int(max_tokens/10)
-
-        splitter = TokenTextSplitter(
-            chunk_size=max_tokens, chunk_overlap=overlap)
-        split_doc = splitter.create_documents([text_doc])
+        if tokens is None:
+            _, tokens = tokenize_doc(doc)
+        max_tokens, overlap = chunk_size_for(
+            len(tokens), num_clusters, ratio, minimum_tokens, maximum_tokens)
+        # Chunks are views into the token array and are only decoded when accessed.
+        split_doc = split_token_array(
+            tokens, max_tokens, overlap, get_encoding())
         return split_doc
     except Exception as e:
         print(str(e))
 
 
-def extract_summary_docs(langchain_document, num_clusters, api_key, find_clusters):
+def extract_summary_docs(langchain_document, num_clusters, api_key, find_clusters, tokens=None, progress=None,
+                         checkpoint=None):
     """
     Automatically convert a single langchain Document object into a list of smaller langchain Document objects that represent each cluster.
 
@@ -297,26 +416,46 @@ def extract_summary_docs(langchain_document, num_clusters, api_key, find_cluster
 
     :param find_clusters: Whether to find the optimal number of clusters to use.
 
-    :return: A list of langchain Document objects.
-    """
-    try:
-        split_document = split_by_tokens(langchain_document, num_clusters)
-        vectors = embed_docs_openai(split_document, api_key)
+    :param tokens: The token ids of the document, if already computed.
 
-        if find_clusters:
-            kmeans = kmeans_clustering(vectors, None)
+    :param progress: An optional progress(event, data) callback, called with "chunked" and "embedded" events.
 
-        else:
-            kmeans = kmeans_clustering(vectors, num_clusters)
+    :param checkpoint: An optional PipelineCheckpoint holding the selected chunks of an earlier run.
 
-        indices = get_closest_vectors(vectors, kmeans)
+    :return: A list of langchain Document objects.
+    """
+    try:
+        split_document = split_by_tokens(
+            langchain_document, num_clusters, tokens=tokens)
+        if progress:
+            progress("chunked", {"chunks": len(split_document)})
+        # The split is deterministic, so the chunk indices selected by an earlier run still apply.
+        indices = checkpoint.load("clusters") if checkpoint else None
+        if indices is None:
+            # Build the float32 matrix once for clustering and centroid selection.
+            vectors = np.asarray(embed_docs_openai(
+                split_document, api_key), dtype=np.float32)
+            if progress:
+                progress("embedded", {"chunks": len(vectors)})
+
+            if find_clusters:
+                kmeans = kmeans_clustering(vectors, None)
+
+            else:
+                kmeans = kmeans_clustering(vectors, num_clusters)
+
+            indices = [int(i) for i in get_closest_vectors(vectors, kmeans)]
+            if checkpoint:
+                # Map summaries are stored by position in the selection, a new selection invalidates them.
+                checkpoint.reset_map()
+                checkpoint.save("clusters", indices)
         summary_docs = map_vectors_to_docs(indices, split_document)
         return summary_docs
     except Exception as e:
         print(str(e))
 
 
-def doc_to_final_summary(langchain_document, num_clusters, initial_prompt_list, final_prompt_list, api_key, use_gpt_4, find_clusters=False):
+def doc_to_final_summary(langchain_document, num_clusters, initial_prompt_list, final_prompt_list, api_key, use_gpt_4, find_clusters=False, tokens=None, report=None, progress=None, checkpoint=None):
     """
     Automatically summarize a single langchain Document object using multiple langchain summarize chains.
 
@@ -334,14 +473,22 @@ def doc_to_final_summary(langchain_document, num_clusters, initial_prompt_list,
 
     :param find_clusters: Whether to automatically find the optimal number of clusters to use.
 
+    :param tokens: The token ids of the document, if already computed.
+
+    :param report: An optional dict updated with the coverage of the map phase.
+
+    :param progress: An optional progress(event, data) callback receiving the stage events and the summary tokens.
+
+    :param checkpoint: An optional PipelineCheckpoint to resume from and save the completed stages to.
+
     :return: A string containing the summary.
     """
     try:
         initial_prompt_list = create_summarize_chain(initial_prompt_list)
         summary_docs = extract_summary_docs(
-            langchain_document, num_clusters, api_key, find_clusters)
+            langchain_document, num_clusters, api_key, find_clusters, tokens, progress, checkpoint)
         output = create_summary_from_docs(
-            summary_docs, initial_prompt_list, final_prompt_list, api_key, use_gpt_4)
+            summary_docs, initial_prompt_list, final_prompt_list, api_key, use_gpt_4, report, progress, checkpoint)
         return output
     except Exception as e:
         print(str(e))
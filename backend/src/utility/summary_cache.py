@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import hashlib
+import pathlib
+import threading
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "disk" keeps entries as json files under SUMMARY_CACHE_DIR, "memory" keeps them in process only.
+# Both evict the least recently used entry once SUMMARY_CACHE_MAX_ENTRIES is reached.
+SUMMARY_CACHE_BACKEND = os.getenv("SUMMARY_CACHE_BACKEND", "disk")
+SUMMARY_CACHE_DIR = os.getenv(
+    "SUMMARY_CACHE_DIR", str(pathlib.Path.home() / "summary_cache"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", 500))
+
+_memory_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def hash_file(file_location, block_size=1 << 20):
+    """
+    Compute the SHA-256 of a file's bytes.
+
+    :param file_location: The path of the file to hash.
+
+    :return: The hex digest of the file.
+    """
+    sha = hashlib.sha256()
+    with open(file_location, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def summary_cache_key(document_hash, settings):
+    """
+    Build the cache key for a document summarized with the given settings.
+
+    :param document_hash: The SHA-256 of the uploaded bytes.
+
+    :param settings: A json serializable dict of the prompt/model/cluster settings.
+
+    :return: The cache key.
+    """
+    payload = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(f"{document_hash}:{payload}".encode("utf-8")).hexdigest()
+
+
+def _entry_path(key):
+    return pathlib.Path(SUMMARY_CACHE_DIR) / f"{key}.json"
+
+
+def _evict_disk_entries():
+    entries = sorted(pathlib.Path(SUMMARY_CACHE_DIR).glob("*.json"),
+                     key=lambda p: p.stat().st_mtime)
+    for path in entries[:max(0, len(entries) - SUMMARY_CACHE_MAX_ENTRIES)]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def get_cached_summary(key):
+    """
+    Look up a cached summary entry.
+
+    :param key: The key returned by summary_cache_key.
+
+    :return: The cached entry dict, or None on a miss.
+    """
+    with _lock:
+        if SUMMARY_CACHE_BACKEND == "memory":
+            entry = _memory_cache.get(key)
+            if entry is not None:
+                _memory_cache.move_to_end(key)
+            return entry
+        path = _entry_path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # Touch the entry so eviction is least recently used rather than oldest written.
+        os.utime(path, None)
+        return entry
+
+
+def cache_summary(key, entry):
+    """
+    Store a summary entry, evicting the least recently used entries when the cache is full.
+
+    :param key: The key returned by summary_cache_key.
+
+    :param entry: A json serializable dict holding the summary.
+
+    :return: None.
+    """
+    entry = dict(entry, cached_at=time.time())
+    with _lock:
+        if SUMMARY_CACHE_BACKEND == "memory":
+            _memory_cache[key] = entry
+            _memory_cache.move_to_end(key)
+            while len(_memory_cache) > SUMMARY_CACHE_MAX_ENTRIES:
+                _memory_cache.popitem(last=False)
+            return
+        pathlib.Path(SUMMARY_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+        path = _entry_path(key)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        _evict_disk_entries()
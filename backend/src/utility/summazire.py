@@ -1,14 +1,38 @@
 import streamlit as st
 
 from backend.src.utility.summariztion_utils import (
-    doc_loader, summary_prompt_creator, doc_to_final_summary,
+    doc_loader, summary_prompt_creator, doc_to_final_summary, tokenize_doc,
 )
 from backend.src.utility.my_prompts import file_map, file_combine, youtube_map, youtube_combine
 from backend.src.utility.text_utils import check_gpt_4, check_key_validity, create_temp_file, create_chat_model, \
-    token_limit, token_minimum
+    token_limit, token_minimum, chat_model_max_tokens, CHAT_MODEL
 
+NUM_CLUSTERS = 10
 
-def process_summarize_button(file_or_transcript, api_key, use_gpt_4, find_clusters, file=True):
+
+def get_summary_settings(use_gpt_4, find_clusters, file=True):
+    """
+    Collects the prompt, model and cluster settings that determine the generated summary
+
+    :param use_gpt_4: Whether to use GPT-4 or not
+
+    :param find_clusters: Whether to find optimal clusters or not
+
+    :return: A json serializable dict of the settings
+    """
+    return {
+        "map_prompt": file_map if file else youtube_map,
+        "combine_prompt": file_combine if file else youtube_combine,
+        "map_model": CHAT_MODEL,
+        "map_max_tokens": chat_model_max_tokens(use_gpt_4),
+        "combine_model": 'gpt-4' if use_gpt_4 else 'gpt-3.5-turbo',
+        "num_clusters": NUM_CLUSTERS,
+        "find_clusters": bool(find_clusters),
+    }
+
+
+def process_summarize_button(file_or_transcript, api_key, use_gpt_4, find_clusters, file=True, text_path=None, report=None, progress=None,
+                             checkpoint=None):
     """
     Processes the summarize button, and displays the summary if input and doc size are valid
 
@@ -20,15 +44,31 @@ def process_summarize_button(file_or_transcript, api_key, use_gpt_4, find_cluste
 
     :param find_clusters: Whether to find optimal clusters or not, experimental
 
+    :param text_path: Already extracted text of the file, skips parsing the PDF again
+
+    :param report: An optional dict updated with the coverage of the map phase
+
+    :param progress: An optional progress(event, data) callback receiving the stage events and the summary tokens
+
+    :param checkpoint: An optional PipelineCheckpoint to resume from and save the completed stages to
+
     :return: None
     """
     try:
+        final_summary = checkpoint.load("final") if checkpoint else None
+        if final_summary:
+            return final_summary
+
         # print(file_or_transcript)
         # if not validate_input(file_or_transcript, api_key, use_gpt_4):
         #     return
 
         # with st.spinner("Summarizing... please wait..."):
-        if file_or_transcript:
+        if text_path:
+            doc = doc_loader(text_path)
+            map_prompt = file_map
+            combine_prompt = file_combine
+        elif file_or_transcript:
             temp_file_path = create_temp_file(file_or_transcript)
             print(temp_file_path)
             doc = doc_loader(temp_file_path)
@@ -42,7 +82,13 @@ def process_summarize_button(file_or_transcript, api_key, use_gpt_4, find_cluste
         llm = create_chat_model(api_key, use_gpt_4)
         initial_prompt_list = summary_prompt_creator(map_prompt, 'text', llm)
         final_prompt_list = summary_prompt_creator(combine_prompt, 'text', llm)
-        if not validate_doc_size(doc)["result"]:
+        # Tokenize once and reuse the tokens for validation and splitting
+        tokens = checkpoint.load_array("tokens") if checkpoint else None
+        if tokens is None:
+            _, tokens = tokenize_doc(doc)
+            if checkpoint:
+                checkpoint.save_array("tokens", tokens)
+        if not validate_doc_size(doc, len(tokens))["result"]:
             if file:
                 pass
                 # os.unlink(temp_file_path)
@@ -50,11 +96,12 @@ def process_summarize_button(file_or_transcript, api_key, use_gpt_4, find_cluste
 
         if find_clusters:
             summary = doc_to_final_summary(
-                doc, 10, initial_prompt_list, final_prompt_list, api_key, use_gpt_4, find_clusters)
+                doc, NUM_CLUSTERS, initial_prompt_list, final_prompt_list, api_key, use_gpt_4, find_clusters, tokens, report, progress, checkpoint)
 
         else:
             summary = doc_to_final_summary(
-                doc, 10, initial_prompt_list, final_prompt_list, api_key, use_gpt_4)
+                doc, NUM_CLUSTERS, initial_prompt_list, final_prompt_list, api_key, use_gpt_4, tokens=tokens, report=report, progress=progress,
+                checkpoint=checkpoint)
 
         # st.markdown(summary, unsafe_allow_html=True)
         if file:
@@ -65,19 +112,25 @@ def process_summarize_button(file_or_transcript, api_key, use_gpt_4, find_cluste
         print(str(e))
 
 
-def validate_doc_size(doc):
+def validate_doc_size(doc, count=None):
     """
     Validates the size of the document
 
     :param doc: doc to validate
 
+    :param count: The token count of the doc, if already computed
+
     :return: True if the doc is valid, False otherwise
     """
-    if not token_limit(doc, 800000):
+    if count is None:
+        _, tokens = tokenize_doc(doc)
+        count = len(tokens)
+
+    if not token_limit(doc, 800000, count):
         # st.warning('File or transcript too big!')
         return {"result": False, "msg": 'File or transcript too big!'}
 
-    if not token_minimum(doc, 2000):
+    if not token_minimum(doc, 2000, count):
         # st.warning('File or transcript too small!')
         return {"result": False, "msg": 'File or transcript too small!'}
     return {"result": True, "msg": 'Success'}
@@ -0,0 +1,45 @@
+import re
+
+# Matches <|endoftext|>, <|fim_prefix|>, <|fim_middle|>, <|fim_suffix|> and <|endofprompt|>.
+# Also matches the tokens with a missing or flipped bracket, e.g. '>|endoftext|' or '<|fim_prefix|'.
+_SPECIAL_TOKEN_PATTERN = re.compile(
+    r'[<>]?\|(?:endoftext|fim_prefix|fim_middle|fim_suffix|endofprompt)\|>?')
+
+
+def scrub_special_tokens(text):
+    """
+    Remove special tokens from a string of text in a single regex pass.
+
+    :param text: The text to clean.
+
+    :return: A tuple of the cleaned text and the number of special tokens removed.
+    """
+    return _SPECIAL_TOKEN_PATTERN.subn('', text)
+
+
+def scrub_pages(pages):
+    """
+    Assemble pages of text into one cleaned string.
+
+    :param pages: An iterable of page texts.
+
+    :return: A tuple of the cleaned text and the number of special tokens removed.
+    """
+    return scrub_special_tokens(''.join(pages))
+
+
+def iter_scrubbed_pages(pages, counter=None):
+    """
+    Remove special tokens from a stream of pages.
+
+    :param pages: An iterable of page texts.
+
+    :param counter: An optional dict whose "removed" count is incremented.
+
+    :return: A generator of cleaned page texts.
+    """
+    for page in pages:
+        page, removed = scrub_special_tokens(page)
+        if counter is not None:
+            counter["removed"] = counter.get("removed", 0) + removed
+        yield page
@@ -1,12 +1,11 @@
 import tempfile
 
-import PyPDF2
-
-from io import StringIO
-
 from langchain.chat_models import ChatOpenAI
 
 from backend.src.utility.summariztion_utils import doc_to_text, token_counter
+from backend.src.utility.pdf_extraction import iter_pdf_pages, extract_pdf_text
+
+CHAT_MODEL = 'gpt-3.5-turbo'
 
 
 def pdf_to_text(pdf_file):
@@ -17,12 +16,7 @@ def pdf_to_text(pdf_file):
 
     :return: A string of text.
     """
-    pdf_reader = PyPDF2.PdfReader(pdf_file)
-    text = StringIO()
-    for i in range(len(pdf_reader.pages)):
-        p = pdf_reader.pages[i]
-        text.write(p.extract_text())
-    return text.getvalue().encode('utf-8')
+    return extract_pdf_text(pdf_file).encode('utf-8')
 
 
 def check_gpt_4(api_key):
@@ -41,7 +35,7 @@ def check_gpt_4(api_key):
         return False
 
 
-def token_limit(doc, maximum=200000):
+def token_limit(doc, maximum=200000, count=None):
     """
     Check if a document has more tokens than a specified maximum.
 
@@ -49,17 +43,19 @@ def token_limit(doc, maximum=200000):
 
     :param maximum: The maximum number of tokens allowed.
 
+    :param count: The token count of the document, if already computed.
+
     :return: True if the document has less than the maximum number of tokens, False otherwise.
     """
-    text = doc_to_text(doc)
-    count = token_counter(text)
+    if count is None:
+        count = token_counter(doc_to_text(doc))
     print(count)
     if count > maximum:
         return False
     return True
 
 
-def token_minimum(doc, minimum=2000):
+def token_minimum(doc, minimum=2000, count=None):
     """
     Check if a document has more tokens than a specified minimum.
 
@@ -67,10 +63,12 @@ def token_minimum(doc, minimum=2000):
 
     :param minimum: The minimum number of tokens allowed.
 
+    :param count: The token count of the document, if already computed.
+
     :return: True if the document has more than the minimum number of tokens, False otherwise.
     """
-    text = doc_to_text(doc)
-    count = token_counter(text)
+    if count is None:
+        count = token_counter(doc_to_text(doc))
     if count < minimum:
         return False
     return True
@@ -104,7 +102,9 @@ def create_temp_file(uploaded_file):
     """
     with tempfile.NamedTemporaryFile(delete=False, suffix='.txt') as temp_file:
         # if uploaded_file.type == 'application/pdf':
-        temp_file.write(pdf_to_text(uploaded_file))
+        # Write page by page so the whole document is never held as one string.
+        for page in iter_pdf_pages(uploaded_file):
+            temp_file.write(page.encode('utf-8'))
         # else:
         # temp_file.write(uploaded_file.getvalue())
     return temp_file.name
@@ -120,7 +120,15 @@ def create_chat_model(api_key, use_gpt_4):
 
     :return: A chat model.
     """
-    if use_gpt_4:
-        return ChatOpenAI(openai_api_key=api_key, temperature=0, max_tokens=500, model_name='gpt-3.5-turbo')
-    else:
-        return ChatOpenAI(openai_api_key=api_key, temperature=0, max_tokens=250, model_name='gpt-3.5-turbo')
+    return ChatOpenAI(openai_api_key=api_key, temperature=0, max_tokens=chat_model_max_tokens(use_gpt_4), model_name=CHAT_MODEL)
+
+
+def chat_model_max_tokens(use_gpt_4):
+    """
+    Get the max tokens of the chat model used for the map step.
+
+    :param use_gpt_4: Whether to use GPT-4 or not.
+
+    :return: The max tokens for each generated chunk summary.
+    """
+    return 500 if use_gpt_4 else 250
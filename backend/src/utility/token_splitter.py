@@ -0,0 +1,110 @@
+from collections.abc import Sequence
+
+import numpy as np
+from langchain.schema import Document
+
+
+def to_token_array(tokens):
+    """
+    Convert a list of token ids into a NumPy array the splitter can slice without copying.
+
+    :param tokens: A list of token ids.
+
+    :return: A uint32 NumPy array of token ids.
+    """
+    return np.asarray(tokens, dtype=np.uint32)
+
+
+def chunk_size_for(num_tokens, num_clusters, ratio=5, minimum_tokens=200, maximum_tokens=2000):
+    """
+    Compute the chunk size and overlap used to split a document, aiming for num_clusters * ratio chunks.
+
+    :param num_tokens: The number of tokens in the document.
+
+    :param num_clusters: The number of clusters to use.
+
+    :param ratio: The ratio of documents to clusters to use for splitting.
+
+    :param minimum_tokens: The minimum number of tokens per chunk.
+
+    :param maximum_tokens: The maximum number of tokens per chunk.
+
+    :return: A tuple of the chunk size and the overlap in tokens.
+    """
+    chunks = num_clusters * ratio
+    max_tokens = int(num_tokens / chunks)
+    max_tokens = max(minimum_tokens, min(max_tokens, maximum_tokens))
+    overlap = int(max_tokens/10)
+    return max_tokens, overlap
+
+
+def chunk_boundaries(num_tokens, chunk_size, overlap):
+    """
+    Compute the [start, end) token ranges of overlapping chunks, matching langchain's TokenTextSplitter.
+
+    :param num_tokens: The number of tokens in the document.
+
+    :param chunk_size: The number of tokens per chunk.
+
+    :param overlap: The number of tokens shared by consecutive chunks.
+
+    :return: An (n, 2) NumPy array of start and end indices.
+    """
+    if num_tokens == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    step = chunk_size - overlap
+    starts = np.arange(0, num_tokens, step, dtype=np.int64)
+    ends = np.minimum(starts + chunk_size, num_tokens)
+    # Stop at the first chunk that reaches the end of the document.
+    last = int(np.argmax(ends == num_tokens))
+    return np.stack([starts[:last + 1], ends[:last + 1]], axis=1)
+
+
+class TokenChunks(Sequence):
+    """
+    A sequence of langchain Document chunks backed by views into a token array.
+    A chunk is only decoded to text the first time it is accessed.
+    """
+
+    def __init__(self, tokens, boundaries, encoding):
+        self.tokens = tokens
+        self.boundaries = boundaries
+        self.encoding = encoding
+        self._docs = {}
+
+    def __len__(self):
+        return len(self.boundaries)
+
+    def chunk_tokens(self, i):
+        start, end = self.boundaries[i]
+        return self.tokens[start:end]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        if i not in self._docs:
+            text = self.encoding.decode(self.chunk_tokens(i).tolist())
+            self._docs[i] = Document(page_content=text)
+        return self._docs[i]
+
+
+def split_token_array(tokens, chunk_size, overlap, encoding):
+    """
+    Split a token array into overlapping chunks without re-encoding the text.
+
+    :param tokens: A NumPy array of token ids.
+
+    :param chunk_size: The number of tokens per chunk.
+
+    :param overlap: The number of tokens shared by consecutive chunks.
+
+    :param encoding: The tiktoken encoding used to decode chunks on access.
+
+    :return: A TokenChunks sequence of langchain Document objects.
+    """
+    tokens = to_token_array(tokens)
+    return TokenChunks(tokens, chunk_boundaries(len(tokens), chunk_size, overlap), encoding)
@@ -0,0 +1,290 @@
+"""
+A vector store interface with Pinecone and a local on disk backend.
+
+Both backends expose the subset of the Pinecone client the code base uses: Index(name), list_indexes().names()
+and create_index(...), and indexes support upsert, query, delete, list and describe_index_stats.
+The local backend keeps every namespace as a flat float32 matrix memory-mapped from disk, so small per-file
+namespaces are searched in process with no network hop and the pipeline can run offline.
+"""
+import os
+import json
+import shutil
+import pathlib
+import threading
+from urllib.parse import quote, unquote
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "pinecone" uses the hosted indexes, "local" keeps the vectors under LOCAL_VECTOR_STORE_DIR.
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "pinecone")
+LOCAL_VECTOR_STORE_DIR = os.getenv(
+    "LOCAL_VECTOR_STORE_DIR", str(pathlib.Path.home() / "vector_store"))
+# The vector file of a local namespace grows by this many rows at a time.
+LOCAL_VECTOR_GROWTH = int(os.getenv("LOCAL_VECTOR_GROWTH", 1024))
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _atomic_write(path, write):
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class LocalNamespace:
+    """
+    The vectors of one namespace: a memory-mapped float32 matrix of unit vectors with spare rows, plus a log of
+    the id and metadata written to each row. An upsert writes its rows in place and appends them to the log,
+    a delete only logs the rows as free for later upserts, so neither rewrites the namespace.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.vectors_path = directory / "vectors.f32"
+        self.meta_path = directory / "meta.json"
+        self.log_path = directory / "rows.jsonl"
+        # Per row, None for a free row.
+        self.ids, self.metadata, self.dimension = [], [], 0
+        self.log_lines = 0
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        if self.meta_path.exists():
+            with open(self.meta_path, "r") as f:
+                self.dimension = json.load(f)["dimension"]
+            self._load_log()
+            capacity = self.vectors_path.stat().st_size // (4 * self.dimension)
+            if capacity:
+                self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                         shape=(capacity, self.dimension))
+        self.rows = {vector_id: row for row, vector_id in enumerate(self.ids) if vector_id is not None}
+        self.free = [row for row, vector_id in enumerate(self.ids) if vector_id is None]
+
+    def _load_log(self):
+        try:
+            with open(self.log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave a partial last line, its rows were never acknowledged.
+                        continue
+                    self.log_lines += 1
+                    row = record["row"]
+                    if row >= len(self.ids):
+                        self.ids.extend([None] * (row + 1 - len(self.ids)))
+                        self.metadata.extend([None] * (row + 1 - len(self.metadata)))
+                    self.ids[row], self.metadata[row] = record["id"], record["metadata"]
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _reserve(self, count):
+        capacity = len(self.vectors)
+        if count <= capacity:
+            return
+        # The file grows by whole chunks of zeroed rows, the written rows are never copied.
+        capacity = -(-count // LOCAL_VECTOR_GROWTH) * LOCAL_VECTOR_GROWTH
+        if isinstance(self.vectors, np.memmap):
+            self.vectors.flush()
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dimension * 4)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                 shape=(capacity, self.dimension))
+
+    def _append_log(self, records):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+        self.log_lines += len(records)
+        # Updates and deletes leave stale lines behind, the log is rewritten once they outnumber the rows.
+        if self.log_lines > 2 * len(self.ids) + LOCAL_VECTOR_GROWTH:
+            records = [{"row": row, "id": vector_id, "metadata": self.metadata[row]}
+                       for row, vector_id in enumerate(self.ids) if vector_id is not None]
+            _atomic_write(self.log_path, lambda f: f.write(
+                "".join(json.dumps(record) + "\n" for record in records).encode("utf-8")))
+            self.log_lines = len(records)
+
+    def upsert(self, vectors):
+        # The last write of an id in the batch wins, like repeated upserts.
+        updates = {vector["id"]: (vector["values"], vector.get("metadata", {}))
+                   for vector in vectors}
+        if not updates:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not self.dimension:
+            self.dimension = len(next(iter(updates.values()))[0])
+            _atomic_write(self.meta_path, lambda f: f.write(
+                json.dumps({"dimension": self.dimension}).encode("utf-8")))
+        rows, values, records = [], [], []
+        for vector_id, (vector_values, vector_metadata) in updates.items():
+            row = self.rows.get(vector_id)
+            if row is None:
+                if self.free:
+                    row = self.free.pop()
+                else:
+                    row = len(self.ids)
+                    self.ids.append(None)
+                    self.metadata.append(None)
+                self.rows[vector_id] = row
+            self.ids[row], self.metadata[row] = vector_id, vector_metadata
+            rows.append(row)
+            values.append(vector_values)
+            records.append({"row": row, "id": vector_id, "metadata": vector_metadata})
+        self._reserve(len(self.ids))
+        self.vectors[rows] = _normalize(values)
+        # The rows are on disk before the log names them, a reader never sees an id without its vector.
+        self.vectors.flush()
+        self._append_log(records)
+
+    def delete(self, ids):
+        rows = [self.rows.pop(vector_id) for vector_id in ids if vector_id in self.rows]
+        if not rows:
+            return
+        for row in rows:
+            self.ids[row] = self.metadata[row] = None
+        self.free.extend(rows)
+        self._append_log([{"row": row, "id": None, "metadata": None} for row in rows])
+
+    def query(self, vector, top_k, include_metadata):
+        if not self.rows:
+            return []
+        scores = self.vectors[:len(self.ids)] @ _normalize(vector)
+        if self.free:
+            scores[self.free] = -np.inf
+        top_k = min(top_k, len(self.rows))
+        rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        rows = rows[np.argsort(-scores[rows], kind="stable")]
+        matches = []
+        for row in rows:
+            match = {"id": self.ids[row], "score": float(scores[row])}
+            if include_metadata:
+                match["metadata"] = self.metadata[row]
+            matches.append(match)
+        return matches
+
+
+class LocalIndex:
+    """
+    A local index with the Pinecone Index methods the code base uses. Namespaces are loaded lazily and kept open.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+        self._namespaces = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _directory_name(namespace):
+        # The empty default namespace cannot be a directory name, every other one is url quoted.
+        return quote(namespace, safe="") if namespace else "__default__"
+
+    def _namespace(self, namespace):
+        with self._lock:
+            if namespace not in self._namespaces:
+                self._namespaces[namespace] = LocalNamespace(
+                    self.directory / self._directory_name(namespace))
+            return self._namespaces[namespace]
+
+    def upsert(self, vectors, namespace=""):
+        # Callers may pass a generator, it is read once.
+        vectors = list(vectors)
+        with self._lock:
+            self._namespace(namespace).upsert(vectors)
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids, namespace=""):
+        with self._lock:
+            self._namespace(namespace).delete(ids)
+
+    def query(self, vector, top_k=10, namespace="", include_metadata=False, **kwargs):
+        # Pinecone accepts a batch of one query vector, the callers pass [xq].
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            return {"matches": self._namespace(namespace).query(vector, top_k, include_metadata),
+                    "namespace": namespace}
+
+    def list(self, prefix="", namespace=""):
+        with self._lock:
+            ids = [vector_id for vector_id in self._namespace(namespace).ids
+                   if vector_id is not None and vector_id.startswith(prefix)]
+        for start in range(0, len(ids), 100):
+            yield ids[start:start + 100]
+
+    def describe_index_stats(self):
+        with self._lock:
+            names = set(self._namespaces)
+            if self.directory.exists():
+                names.update(
+                    "" if path.name == "__default__" else unquote(path.name)
+                    for path in self.directory.iterdir() if path.is_dir())
+            namespaces = {name: {"vector_count": len(self._namespace(name))}
+                          for name in names}
+        namespaces = {name: stats for name,
+                      stats in namespaces.items() if stats["vector_count"]}
+        return {"namespaces": namespaces,
+                "total_vector_count": sum(stats["vector_count"] for stats in namespaces.values())}
+
+
+class _IndexList(list):
+    def names(self):
+        return list(self)
+
+
+class LocalVectorClient:
+    """
+    A drop-in for the Pinecone client backed by LocalIndex directories under root.
+    """
+
+    def __init__(self, root=LOCAL_VECTOR_STORE_DIR):
+        self.root = pathlib.Path(root)
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def Index(self, name):
+        with self._lock:
+            if name not in self._indexes:
+                self._indexes[name] = LocalIndex(self.root / name)
+            return self._indexes[name]
+
+    def list_indexes(self):
+        names = set(self._indexes)
+        if self.root.exists():
+            names.update(path.name for path in self.root.iterdir()
+                         if path.is_dir())
+        return _IndexList(sorted(names))
+
+    def create_index(self, name, **kwargs):
+        (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    def delete_index(self, name):
+        with self._lock:
+            self._indexes.pop(name, None)
+        shutil.rmtree(self.root / name, ignore_errors=True)
+
+
+def get_vector_client():
+    """
+    Get the process wide vector store client selected by VECTOR_STORE_BACKEND.
+
+    :return: A Pinecone client or a LocalVectorClient.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            if VECTOR_STORE_BACKEND == "local":
+                _client = LocalVectorClient()
+            else:
+                from pinecone import Pinecone
+                _client = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+        return _client
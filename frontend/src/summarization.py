@@ -1,7 +1,77 @@
+import time
+import json
 import streamlit as st
 import requests
 
 
+def wait_for_job(url, job_id, poll_interval=2):
+    """
+    Poll the backend until an upload job is finished.
+
+    :return: The job result response.
+    """
+    while True:
+        response = requests.get(f"{url}jobs/{job_id}")
+        if response.status_code != 200:
+            return response
+        if response.json()["status"] in ("done", "failed"):
+            return requests.get(f"{url}jobs/{job_id}/result")
+        time.sleep(poll_interval)
+
+
+def iter_job_events(url, job_id):
+    """
+    Read the Server-Sent Events of an upload job.
+
+    :return: A generator of (event, data) tuples.
+    """
+    with requests.get(f"{url}jobs/{job_id}/events", stream=True, timeout=(5, None)) as response:
+        if response.status_code != 200:
+            return
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                yield event, json.loads(line[len("data: "):])
+
+
+def stream_job(url, job_id):
+    """
+    Render the progress of an upload job and the summary as it is generated.
+
+    :return: A tuple of the last event ("done" or "failed") and its data, or (None, None) if the stream ended early.
+    """
+    status = st.empty()
+    progress_bar = st.progress(0.0)
+    summary_box = st.empty()
+    tokens = []
+    messages = {"cached": "Found a previous summary of this document", "extracted": "Text extracted",
+                "reduce": "Condensing the section summaries...", "combine": "Writing the summary..."}
+    for event, data in iter_job_events(url, job_id):
+        if event in messages:
+            status.text(messages[event])
+        elif event == "chunked":
+            status.text(f"Split into {data['chunks']} chunks")
+        elif event == "embedded":
+            status.text(f"Embedded {data['chunks']} chunks")
+        elif event == "map":
+            progress_bar.progress(data["done"] / data["total"])
+            status.text(
+                f"Summarized {data['done']} of {data['total']} sections")
+        elif event == "token":
+            tokens.append(data["text"])
+            summary_box.markdown(''.join(tokens), unsafe_allow_html=True)
+        elif event in ("done", "failed"):
+            status.empty()
+            progress_bar.empty()
+            summary_box.empty()
+            return event, data
+    status.empty()
+    progress_bar.empty()
+    return None, None
+
+
 def summarize():
     url = "http://backend:8000/"
     """
@@ -23,6 +93,21 @@ def summarize():
             files = {"file": (uploaded_file.name,
                               uploaded_file.getvalue())}
             response = requests.post(f"{url}upload", files=files)
-            if response.status_code == 200:
-                st.markdown(response.json()[
-                            "summary"], unsafe_allow_html=True)
+            if response.status_code == 202:
+                job_id = response.json()["job_id"]
+                event, result = stream_job(url, job_id)
+                if event is None:
+                    # The stream was cut short, fall back to polling for the result
+                    with st.spinner("Summarizing... please wait..."):
+                        response = wait_for_job(url, job_id)
+                    event = "done" if response.status_code == 200 else "failed"
+                    result = response.json()
+            else:
+                event, result = "failed", response.json()
+            if event == "done":
+                if result.get("coverage", 1.0) < 1.0:
+                    st.warning(
+                        f"Only {result['coverage']:.0%} of the document could be summarized, upload it again to retry the rest.")
+                st.markdown(result["summary"], unsafe_allow_html=True)
+            else:
+                st.error(result.get("detail", "Something went wrong."))
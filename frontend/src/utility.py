@@ -5,6 +5,9 @@ from streamlit.logger import get_logger
 
 logger = get_logger(__name__)
 
+# (user_id, file_name) -> (ETag, summary) of summaries already downloaded
+_file_summary_cache = {}
+
 
 def fetch_summary_data(topic):
     try:
@@ -32,9 +35,17 @@ def fetch_qa_data(topic, set_id):
 def fetch_file_names_data(user_id):
     try:
         logger.info(f"fetching QA data:")
-        response = requests.get(
-            f"http://backend:8000/get_file_names_data/{user_id}/")
-        return response.json().get("data", [])
+        file_names = []
+        params = {}
+        # The backend returns file names a page at a time
+        while True:
+            response = requests.get(
+                f"http://backend:8000/get_file_names_data/{user_id}", params=params)
+            json_data = response.json()
+            file_names.extend(json_data.get("data", []))
+            if not json_data.get("next"):
+                return file_names
+            params["after"] = json_data["next"]
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching QA data: {e}")
         raise Exception(f"Error fetching QA data: {e}")
@@ -43,9 +54,19 @@ def fetch_file_names_data(user_id):
 def fetch_summary_data(user_id, selected_file):
     try:
         logger.info(f"fetching QA data:")
+        cache_key = (user_id, selected_file)
+        headers = {}
+        if cache_key in _file_summary_cache:
+            headers["If-None-Match"] = _file_summary_cache[cache_key][0]
         response = requests.get(
-            f"http://backend:8000/get_file_summary_data/{user_id}/{selected_file}")
-        return response.json().get("data", [])
+            f"http://backend:8000/get_file_summary_data/{user_id}/{selected_file}", headers=headers)
+        # 304 means the summary did not change since we downloaded it
+        if response.status_code == 304:
+            return _file_summary_cache[cache_key][1]
+        data = response.json().get("data", [])
+        if response.ok and response.headers.get("ETag"):
+            _file_summary_cache[cache_key] = (response.headers["ETag"], data)
+        return data
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching QA data: {e}")
         raise Exception(f"Error fetching QA data: {e}")